@@ -0,0 +1,49 @@
+"""Indexes for the hot lookups.
+
+users.discord_id is looked up on every /verifyme and every verification
+result but had no index. command_usage gets a (server_id, timestamp) index
+for per-server usage history. servers.server_id needs nothing: its UNIQUE
+constraint is already backed by an index.
+
+On PostgreSQL the indexes are built CONCURRENTLY (outside the migration
+transaction) so the tables stay writable while they build.
+
+Apply with:
+
+    alembic upgrade head
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_discord_id", "users", ["discord_id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_command_usage_server_id_timestamp", "command_usage", ["server_id", "timestamp"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_command_usage_server_id_timestamp", table_name="command_usage",
+            postgresql_concurrently=True,
+        )
+        op.drop_index("ix_users_discord_id", table_name="users", postgresql_concurrently=True)
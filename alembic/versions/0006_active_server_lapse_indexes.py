@@ -0,0 +1,53 @@
+"""Partial indexes for the weekly subscription lapse scan.
+
+subscription_checker lapses active servers whose last_renewal_date (stripe)
+or entitlement_ends_at (discord) is past a cutoff. Only active servers can
+match, so on PostgreSQL both indexes cover just subscription_status rows
+and the two halves of the OR become index range scans. Built CONCURRENTLY
+so the servers table stays writable.
+
+Apply with:
+
+    alembic upgrade head
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_servers_active_last_renewal_date", "servers", ["last_renewal_date"],
+            postgresql_where=sa.text("subscription_status"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_servers_active_entitlement_ends_at", "servers", ["entitlement_ends_at"],
+            postgresql_where=sa.text("subscription_status"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_servers_active_entitlement_ends_at", table_name="servers",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_servers_active_last_renewal_date", table_name="servers",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,72 @@
+"""Make users.discord_id unique.
+
+stripe_webhook_service now writes verification results with a single
+INSERT ... ON CONFLICT (discord_id) DO UPDATE, which needs a unique index to
+arbitrate on. The old SELECT-then-INSERT could race two webhooks for the
+same user into duplicate rows, so those are collapsed first: per discord_id
+the row kept is a verified one if any, else the most recent attempt.
+
+The unique index uq_users_discord_id replaces the plain ix_users_discord_id
+from 0005. It is built CONCURRENTLY under its new name before the old index
+is dropped, so discord_id lookups stay indexed throughout.
+
+Deploy order: run `alembic upgrade head` BEFORE deploying any code that
+upserts on discord_id (stripe-webhook's handle_verification_verified /
+_canceled and the bot's track_verification_attempt). On PostgreSQL
+ON CONFLICT (discord_id) fails outright while no unique index exists. The
+old SELECT-then-INSERT code can still race a duplicate in between the
+cleanup and the build; the build then fails and leaves an INVALID
+uq_users_discord_id. Drop that index and run the upgrade again.
+
+Apply with:
+
+    alembic upgrade head
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        DELETE FROM users WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY discord_id
+                    ORDER BY COALESCE(verification_status, false) DESC,
+                             last_verification_attempt DESC,
+                             id DESC
+                ) AS rn
+                FROM users
+            ) ranked
+            WHERE rn > 1
+        )
+        """
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "uq_users_discord_id", "users", ["discord_id"], unique=True,
+            postgresql_concurrently=True,
+        )
+        op.drop_index("ix_users_discord_id", table_name="users", postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_discord_id", "users", ["discord_id"],
+            postgresql_concurrently=True,
+        )
+        op.drop_index("uq_users_discord_id", table_name="users", postgresql_concurrently=True)
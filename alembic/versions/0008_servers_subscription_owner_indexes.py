@@ -0,0 +1,46 @@
+"""Index servers.stripe_subscription_id and servers.owner_id.
+
+subscription_manager's delete handler (and the Stripe update path) finds
+servers by stripe_subscription_id, and the bot resolves token-pack guilds by
+owner_id; both were sequential scans. Built CONCURRENTLY so the servers
+table stays writable.
+
+Apply with:
+
+    alembic upgrade head
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_servers_stripe_subscription_id", "servers", ["stripe_subscription_id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_servers_owner_id", "servers", ["owner_id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_servers_owner_id", table_name="servers", postgresql_concurrently=True)
+        op.drop_index(
+            "ix_servers_stripe_subscription_id", table_name="servers",
+            postgresql_concurrently=True,
+        )
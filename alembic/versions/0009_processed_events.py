@@ -0,0 +1,37 @@
+"""Add processed_events for Stripe event idempotency.
+
+subscription_manager records each event id it processes with
+INSERT ... ON CONFLICT DO NOTHING and skips the event when the id is
+already there. subscription_checker prunes rows older than 30 days.
+
+Apply with:
+
+    alembic upgrade head
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "processed_events",
+        sa.Column("event_id", sa.String(length=255), primary_key=True),
+        sa.Column("received_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("processed_events")
@@ -0,0 +1,36 @@
+"""Add servers.stripe_event_created for Stripe event ordering.
+
+Stripe does not deliver events in order. subscription_manager stores the
+`created` time of the newest customer.subscription.* event it applied to a
+server and ignores older events that arrive afterwards (e.g. a retried
+`updated` landing after `deleted`).
+
+Nullable with no default, so this is a metadata-only change on PostgreSQL.
+
+Apply with:
+
+    alembic upgrade head
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("servers", sa.Column("stripe_event_created", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("servers", "stripe_event_created")
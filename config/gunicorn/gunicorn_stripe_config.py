@@ -1,6 +1,13 @@
 bind = "0.0.0.0:5431"
 workers = 2
+# Each webhook blocks on a Stripe retrieve, a DB write and a RabbitMQ
+# publish; threads let a worker overlap that I/O instead of queueing.
+worker_class = "gthread"
+threads = 8
 timeout = 120
+# Each event is processed before it is acked; on restart, give in-flight
+# requests time to finish before the worker is killed.
+graceful_timeout = 90
 loglevel = "warning"
 errorlog = "-"
-accesslog = "-"
\ No newline at end of file
+accesslog = "-"
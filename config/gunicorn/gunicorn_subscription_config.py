@@ -1,7 +1,14 @@
 bind = "0.0.0.0:5433"
 workers = 3
-worker_class = "sync"
+# Handlers only verify the signature and queue the event, but a sync worker
+# is still held for a whole (possibly slow) client upload; threads let a
+# worker serve other deliveries meanwhile.
+worker_class = "gthread"
+threads = 4
 timeout = 120
+# Events are acked before they are processed on a background pool; on
+# restart, give a worker time to drain that queue before it is killed.
+graceful_timeout = 90
 loglevel = "warning"
 errorlog = "-"
 accesslog = "-"
@@ -11,12 +11,13 @@ Purchased extra-token packs are additive and unrelated to renewals.
 import os
 import logging
 from datetime import timezone
+from types import MappingProxyType
 
 logger = logging.getLogger(__name__)
 
 # Internal tier model. Discord SKUs currently exist for tier_0/1/2/3/5;
 # tier_4/6 remain Stripe-only legacy tiers.
-TIER_TOKENS = {
+TIER_TOKENS = MappingProxyType({
     'tier_0': 0,
     'tier_1': 10,
     'tier_2': 25,
@@ -24,7 +25,7 @@ TIER_TOKENS = {
     'tier_4': 75,
     'tier_5': 100,
     'tier_6': 150,
-}
+})
 
 TOKEN_PACK_SIZES = (10, 25, 50, 100)
 
@@ -50,8 +51,7 @@ def _load_sku_token_pack_map() -> dict:
 
 
 # Discord SKU routing tables (the storefront mirror of subscription_manager's
-# PRODUCT_ID_TO_TIER / PRODUCT_ID_TO_EXTRA_TOKENS). Loaded from env so SKU
-# IDs never live in code.
+# PRODUCT_ID_TO_TIER). Loaded from env so SKU IDs never live in code.
 SKU_ID_TO_TIER = _load_sku_tier_map()
 SKU_ID_TO_EXTRA_TOKENS = _load_sku_token_pack_map()
 
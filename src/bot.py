@@ -1,9 +1,13 @@
 import os
 import re
-import json
+import hashlib
 import asyncio
 import logging
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 from datetime import datetime, timedelta, timezone
 from types import SimpleNamespace
 from typing import Optional
@@ -11,18 +15,19 @@ from urllib.parse import urlparse
 
 import discord
 from discord import app_commands
-from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
-import pika
+import aio_pika
+import orjson
 import stripe
 from cryptography.fernet import Fernet
+from sqlalchemy import bindparam, case, insert, select, update
 
 try:
-    from .models import User, Server, CommandUsage, session_scope
+    from .models import User, Server, CommandUsage, session_scope, snapshot, upsert, SERVER_BY_ID, USER_BY_DISCORD_ID
     from .locales import localizations, LANGUAGE_CODES
     from . import billing
 except ImportError:
-    from models import User, Server, CommandUsage, session_scope
+    from models import User, Server, CommandUsage, session_scope, snapshot, upsert, SERVER_BY_ID, USER_BY_DISCORD_ID
     from locales import localizations, LANGUAGE_CODES
     import billing
 
@@ -49,13 +54,12 @@ def get_message(key: str, interaction: Optional[discord.Interaction] = None,
     return template.format(**kwargs)
 
 
-def get_server_locale(guild_id) -> Optional[str]:
+async def get_server_locale(guild_id) -> Optional[str]:
     """Return the guild's configured instructions locale, or None if unset."""
     try:
-        with session_scope() as session:
-            server = session.query(Server).filter_by(server_id=str(guild_id)).first()
-            if server and server.instructions_locale in LANGUAGE_CODES:
-                return str(server.instructions_locale)
+        server = await get_server_config_cached(guild_id)
+        if server and server.instructions_locale in LANGUAGE_CODES:
+            return str(server.instructions_locale)
     except Exception:
         logger.warning("Could not load server locale; falling back.", exc_info=True)
     return None
@@ -72,9 +76,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Reduce noise from pika unless explicitly overridden
+# Reduce noise from the AMQP client unless explicitly overridden
 PIKA_LOG_LEVEL = os.getenv('PIKA_LOG_LEVEL', 'WARNING').upper()
-logging.getLogger('pika').setLevel(getattr(logging, PIKA_LOG_LEVEL, logging.WARNING))
+for _amqp_logger in ('aio_pika', 'aiormq'):
+    logging.getLogger(_amqp_logger).setLevel(getattr(logging, PIKA_LOG_LEVEL, logging.WARNING))
 
 # Retrieve environment variables
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
@@ -83,11 +88,16 @@ STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 
 # RabbitMQ Configuration
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
-RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', 5672))
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT') or 5672)
 RABBITMQ_USERNAME = os.getenv('RABBITMQ_USERNAME')
 RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')
 RABBITMQ_VHOST = os.getenv('RABBITMQ_VHOST', '/')
 RABBITMQ_QUEUE_NAME = os.getenv('RABBITMQ_QUEUE_NAME', 'verification_results')
+# Max unacked deliveries in flight; bounds local buffering on (re)connect
+RABBITMQ_PREFETCH = int(os.getenv('RABBITMQ_PREFETCH', '100'))
+# Processed deliveries are acked with one multiple=True frame per batch
+RABBITMQ_ACK_BATCH = int(os.getenv('RABBITMQ_ACK_BATCH', '25'))
+RABBITMQ_ACK_FLUSH_SECONDS = float(os.getenv('RABBITMQ_ACK_FLUSH_SECONDS', '0.1'))
 
 # Ensure all required environment variables are set
 required_env_vars = ['DISCORD_BOT_TOKEN', 'STRIPE_SECRET_KEY', 'DATABASE_URL_VERIFICATION', 
@@ -133,6 +143,12 @@ class _TTLCache:
                 pass
         self._store[key] = (asyncio.get_running_loop().time() + self.ttl, value)
 
+    def pop(self, key):
+        self._store.pop(key, None)
+
+    def clear(self):
+        self._store.clear()
+
 
 _member_fetch_cache = _TTLCache(REST_CACHE_MAX, REST_TTL_SECONDS)
 _rest_semaphore = asyncio.Semaphore(REST_CONCURRENCY)
@@ -153,6 +169,16 @@ async def fetch_member_cached(guild, user_id: int):
         return member
 
 
+# Global command sync is a rate-limited REST call; it is skipped on restart
+# when the registered command set hashes the same as at the last sync.
+COMMAND_SYNC_HASH_PATH = os.getenv('COMMAND_SYNC_HASH_PATH', '/tmp/verifyme_command_tree.sha256')
+
+
+def _command_tree_hash(tree: app_commands.CommandTree) -> str:
+    payload = sorted((cmd.to_dict(tree) for cmd in tree.get_commands()), key=lambda c: (c['type'], c['name']))
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
 class MyBot(discord.Client):
     def __init__(self):
         # Disable guild member chunking at startup to speed up readiness
@@ -164,7 +190,38 @@ class MyBot(discord.Client):
     async def setup_hook(self):
         # Register persistent views so buttons on existing messages work after restarts
         self.add_view(InstructionsPersistentView())
-        await self.tree.sync()
+        # setup_hook runs once per process (never on gateway reconnects), and
+        # on_ready does not sync. Run the global sync in the background so
+        # the gateway connection isn't held up by a slow REST call.
+        self.loop.create_task(self._sync_command_tree())
+
+    async def _sync_command_tree(self):
+        digest = _command_tree_hash(self.tree)
+        try:
+            with open(COMMAND_SYNC_HASH_PATH) as f:
+                if f.read().strip() == digest:
+                    logger.info("Application commands unchanged since last sync; skipping.")
+                    return
+        except OSError:
+            pass
+        try:
+            synced = await self.tree.sync()
+            logger.info(f"Synced {len(synced)} application commands.")
+        except Exception:
+            logger.error("Application command sync failed.", exc_info=True)
+            return
+        try:
+            with open(COMMAND_SYNC_HASH_PATH, 'w') as f:
+                f.write(digest)
+        except OSError:
+            logger.warning(f"Could not record command tree hash at {COMMAND_SYNC_HASH_PATH}", exc_info=True)
+
+    async def close(self):
+        # Don't drop buffered analytics rows or verification writes on a clean shutdown
+        await flush_command_usage()
+        await _verification_writes.flush()
+        await stripe.default_http_client.close_async()
+        await super().close()
 
 bot = MyBot()
 
@@ -196,6 +253,10 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
 
 # Stripe setup
 stripe.api_key = STRIPE_SECRET_KEY
+# Stripe calls from the bot go through the SDK's *_async methods over one
+# long-lived aiohttp session (aiohttp ships with discord.py), so they neither
+# block the event loop nor pay a TLS handshake per verification.
+stripe.default_http_client = stripe.RequestsClient(async_fallback_client=stripe.AIOHTTPClient())
 
 # Subscription tier requirements
 tier_requirements = {
@@ -211,6 +272,34 @@ tier_requirements = {
 # Cooldown period (seconds)
 COOLDOWN_PERIOD = 60  # 1 minute cooldown for demonstration purposes
 
+# In-memory mirror of the per-user cooldown so someone spamming /verifyme is
+# turned away without a database round-trip. The last_verification_attempt
+# check in verify() stays authoritative (e.g. after a restart).
+_COOLDOWN_CACHE_SWEEP_AT = 1024
+_cooldown_cache: dict = {}  # user_id (str) -> (monotonic deadline, locale)
+
+
+def _record_cooldown(user_id, locale=None):
+    now = time.monotonic()
+    if len(_cooldown_cache) >= _COOLDOWN_CACHE_SWEEP_AT:
+        for uid, (deadline, _) in list(_cooldown_cache.items()):
+            if deadline <= now:
+                del _cooldown_cache[uid]
+    _cooldown_cache[str(user_id)] = (now + COOLDOWN_PERIOD, locale)
+
+
+def _get_cooldown(user_id):
+    """(seconds_remaining, locale) if the user is cooling down, else None."""
+    entry = _cooldown_cache.get(str(user_id))
+    if not entry:
+        return None
+    deadline, locale = entry
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        _cooldown_cache.pop(str(user_id), None)
+        return None
+    return int(remaining) + 1, locale
+
 # Encryption/Decryption setup
 DOB_KEY = os.getenv('DOB_KEY')
 if not DOB_KEY:
@@ -232,79 +321,91 @@ def decrypt_dob(encrypted_dob: str) -> datetime:
     dob_str = dob_bytes.decode('utf-8')  # Convert bytes back to string
     return datetime.strptime(dob_str, '%Y-%m-%d')  # Convert string to datetime object
 
-# RabbitMQ setup
-credentials = pika.PlainCredentials(RABBITMQ_USERNAME, RABBITMQ_PASSWORD)
-
-
-def _rabbitmq_parameters() -> pika.ConnectionParameters:
-    """Build connection parameters with heartbeats/timeouts so stale connections get detected."""
-    heartbeat = int(os.getenv('RABBITMQ_HEARTBEAT', '60'))
-    blocked_timeout = int(os.getenv('RABBITMQ_BLOCKED_TIMEOUT', '60'))
-    connection_attempts = int(os.getenv('RABBITMQ_CONN_ATTEMPTS', '3'))
-    retry_delay = float(os.getenv('RABBITMQ_RETRY_DELAY', '2'))
-    socket_timeout = float(os.getenv('RABBITMQ_SOCKET_TIMEOUT', '10'))
-
-    return pika.ConnectionParameters(
-        host=RABBITMQ_HOST,
-        port=RABBITMQ_PORT,
-        virtual_host=RABBITMQ_VHOST,
-        credentials=credentials,
-        heartbeat=heartbeat,
-        blocked_connection_timeout=blocked_timeout,
-        connection_attempts=connection_attempts,
-        retry_delay=retry_delay,
-        socket_timeout=socket_timeout,
-    )
-
+def age_in_years(dob: datetime, today: datetime) -> int:
+    """Whole calendar years from dob to today (leap-year safe: a 29 Feb
+    birthday ticks over on 1 Mar in non-leap years)."""
+    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
 
-def _rabbitmq_connect_with_retry(max_tries: int = 0) -> pika.BlockingConnection:
-    """Connect to RabbitMQ with retries.
+# RabbitMQ setup
+async def _rabbitmq_connect_with_retry() -> aio_pika.abc.AbstractRobustConnection:
+    """Open a robust RabbitMQ connection, retrying the initial connect forever.
 
-    max_tries=0 means retry forever (used by the long-running consumer).
+    Once connected, aio-pika's robust connection restores the channel, queue
+    and consumer by itself after broker restarts or network blips.
     """
-    params = _rabbitmq_parameters()
+    heartbeat = int(os.getenv('RABBITMQ_HEARTBEAT', '60'))
+    timeout = float(os.getenv('RABBITMQ_SOCKET_TIMEOUT', '10'))
     attempt = 0
     while True:
         attempt += 1
         try:
-            return pika.BlockingConnection(params)
-        except pika.exceptions.AMQPConnectionError:
-            if max_tries and attempt >= max_tries:
-                raise
+            return await aio_pika.connect_robust(
+                host=RABBITMQ_HOST,
+                port=RABBITMQ_PORT,
+                login=RABBITMQ_USERNAME,
+                password=RABBITMQ_PASSWORD,
+                virtualhost=RABBITMQ_VHOST,
+                heartbeat=heartbeat,
+                timeout=timeout,
+            )
+        except (aio_pika.exceptions.AMQPConnectionError, OSError):
             delay = min(30.0, 2.0 * attempt)
             logger.warning(f"RabbitMQ connection failed; retrying in {delay:.1f}s (attempt {attempt})")
-            time.sleep(delay)
-
-
-def get_rabbitmq_channel():
-    connection = _rabbitmq_connect_with_retry(max_tries=1)
-    channel = connection.channel()
-    channel.queue_declare(queue=RABBITMQ_QUEUE_NAME, durable=True)
-    return channel
+            await asyncio.sleep(delay)
 
 def get_server_config(guild_id):
+    """Snapshot of the guild's Server row (or None). Blocking; use run_db."""
     with session_scope() as session:
-        return session.query(Server).filter_by(server_id=str(guild_id)).first()
+        return snapshot(session.execute(SERVER_BY_ID, {'server_id': str(guild_id)}).scalar())
 
 def get_user_verification_status(discord_id):
+    """Snapshot of the user's User row (or None). Blocking; use run_db."""
     with session_scope() as session:
-        return session.query(User).filter_by(discord_id=str(discord_id)).first()
+        return snapshot(session.execute(USER_BY_DISCORD_ID, {'discord_id': str(discord_id)}).scalar())
 
-async def update_user_verification_status(discord_id, status):
-    def db_update():
-        with session_scope() as session:
-            user = session.query(User).filter_by(discord_id=str(discord_id)).first()
-            if user:
-                user.verification_status = status
-    await main_loop.run_in_executor(None, db_update)
+# SQLAlchemy stays synchronous (models.py is shared with the Flask services
+# and Alembic), so the bot awaits blocking DB work on its own thread pool,
+# sized to the engine's connection pool. A slow query then never freezes the
+# gateway heartbeat, and DB calls don't queue behind other executor work.
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '5'))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking DB callable on db_executor and await its result.
+
+    fn must open its own session_scope() and return plain values, never ORM
+    instances (those would be detached and lazy-load off-thread).
+    """
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(fn, *args, **kwargs))
+
+
+# Server rows change rarely (setup/settings, token spend, billing), so reads
+# are served from a short TTL cache of snapshots. Writes made by this process
+# invalidate it; changes from the webhook services show up within the TTL.
+SERVER_CACHE_TTL_SECONDS = float(os.getenv('SERVER_CACHE_TTL_SECONDS', '30'))
+_server_config_cache = _TTLCache(REST_CACHE_MAX, SERVER_CACHE_TTL_SECONDS)
+
+
+async def get_server_config_cached(guild_id):
+    """Snapshot of the guild's Server row (or None), cached for SERVER_CACHE_TTL_SECONDS."""
+    key = str(guild_id)
+    server = _server_config_cache.get(key)
+    if server is None:
+        server = await run_db(get_server_config, key)
+        if server is not None:
+            _server_config_cache.set(key, server)
+    return server
+
+
+def invalidate_server_config(guild_id):
+    _server_config_cache.pop(str(guild_id))
+
+
+async def save_server_fields(interaction: discord.Interaction, **fields) -> None:
+    await run_db(_save_server_fields, interaction, **fields)
+    invalidate_server_config(interaction.guild.id)
 
-async def decrement_verifications_count(server_id):
-    def db_update():
-        with session_scope() as session:
-            server = session.query(Server).filter_by(server_id=str(server_id)).first()
-            if server and server.verifications_count > 0:
-                server.verifications_count -= 1
-    await main_loop.run_in_executor(None, db_update)
 
 async def dm_localized(member, guild, key: str, instr_locale: Optional[str] = None, **kwargs):
     """Send a localized DM to a member; ignore DM permission errors."""
@@ -352,11 +453,12 @@ def sanitize_custom_message(raw: str) -> tuple[str, list[str]]:
     return raw, invalid
 
 
-async def assign_role(guild_id, user_id, role_id, *, notify_success_dm=False,
+async def assign_role(guild_id: int, user_id: int, role_id: int, *, notify_success_dm=False,
                       success_dm_key="dm_role_success"):
     """Assign the verified role, remove the unverified role if configured, and
     DM the user an explanation when the bot lacks permission (role hierarchy).
 
+    IDs are Discord snowflakes as ints; callers convert once at the edge.
     Returns True if the verified role was assigned.
     """
     # Load per-server settings up front (locale, unverified role, custom DM)
@@ -364,27 +466,25 @@ async def assign_role(guild_id, user_id, role_id, *, notify_success_dm=False,
     instr_locale = None
     custom_success_msg = None
     try:
-        with session_scope() as session:
-            server = session.query(Server).filter_by(server_id=str(guild_id)).first()
-            if server:
-                unverified_role_id = server.unverified_role_id
-                instr_locale = server.instructions_locale if server.instructions_locale in LANGUAGE_CODES else None
-                custom_success_msg = server.custom_verification_message
+        server = await get_server_config_cached(guild_id)
+        if server:
+            unverified_role_id = server.unverified_role_id
+            instr_locale = server.instructions_locale if server.instructions_locale in LANGUAGE_CODES else None
+            custom_success_msg = server.custom_verification_message
     except Exception:
         logger.warning(f"Could not load settings for guild {guild_id}; proceeding with defaults.", exc_info=True)
 
-    guild = bot.get_guild(int(guild_id))
+    guild = bot.get_guild(guild_id)
     if not guild:
         logger.error(f"Guild {guild_id} not found")
         return False
 
-    logger.debug(f"Attempting to find member {user_id} in guild {guild_id}")
-    member = guild.get_member(int(user_id))
-    if not member:
-        # Fallback to REST fetch (works with or without member cache)
+    # Warm member cache is a dict lookup; a cold one costs a single (cached)
+    # REST call. Only a real 404 from Discord means the member is gone.
+    member = guild.get_member(user_id)
+    if member is None:
         try:
-            member = await fetch_member_cached(guild, int(user_id))
-            logger.debug(f"Fetched member {user_id} via REST in guild {guild_id}")
+            member = await fetch_member_cached(guild, user_id)
         except discord.NotFound:
             logger.error(f"Member {user_id} not found in guild {guild_id}")
             return False
@@ -392,7 +492,7 @@ async def assign_role(guild_id, user_id, role_id, *, notify_success_dm=False,
             logger.error(f"HTTP error fetching member {user_id} in guild {guild_id}: {e}")
             return False
 
-    role = guild.get_role(int(role_id))
+    role = guild.get_role(role_id)
     if not role:
         logger.error(f"Role {role_id} not found in guild {guild_id}")
         return False
@@ -438,7 +538,7 @@ async def assign_role(guild_id, user_id, role_id, *, notify_success_dm=False,
             try:
                 await asyncio.sleep(1)
                 try:
-                    fresh_member = await guild.fetch_member(int(user_id))
+                    fresh_member = await guild.fetch_member(user_id)
                 except Exception:
                     fresh_member = None
                 if fresh_member and unverified_role and unverified_role in fresh_member.roles:
@@ -455,26 +555,32 @@ async def assign_role(guild_id, user_id, role_id, *, notify_success_dm=False,
 
     return assigned
 
+# Identity session settings are the same for every verification; only the
+# metadata varies per call. The SDK only reads these, never mutates them.
+_VERIFY_TYPE = 'document'
+_VERIFY_OPTIONS = {
+    'document': {
+        'require_id_number': False,
+        'require_live_capture': True,
+        'require_matching_selfie': True
+    }
+}
+
+
 async def generate_stripe_verification_url(guild_id, user_id, role_id, channel_id):
     try:
-        logger.debug(f"Creating Stripe verification session for user {user_id}")
-        verification_session = stripe.identity.VerificationSession.create(
-            type='document',
+        logger.debug("Creating Stripe verification session for user %s", user_id)
+        verification_session = await stripe.identity.VerificationSession.create_async(
+            type=_VERIFY_TYPE,
             metadata={
                 'guild_id': str(guild_id),
                 'user_id': str(user_id),
                 'role_id': str(role_id),
                 'channel_id': str(channel_id)
             },
-            options={
-                'document': {
-                    'require_id_number': False,
-                    'require_live_capture': True,
-                    'require_matching_selfie': True
-                }
-            }
+            options=_VERIFY_OPTIONS,
         )
-        logger.debug(f"Successfully created Stripe verification session for user {user_id}")
+        logger.debug("Successfully created Stripe verification session for user %s", user_id)
         return verification_session.url
     except stripe.error.StripeError as e:
         logger.error(f"Stripe API error for user {user_id}: {str(e)}")
@@ -483,20 +589,137 @@ async def generate_stripe_verification_url(guild_id, user_id, role_id, channel_i
         logger.error(f"Unexpected error in generate_stripe_verification_url for user {user_id}: {str(e)}", exc_info=True)
         return None
 
-async def process_verification_result(message):
-    data = json.loads(message)
-    logger.debug(f"Received message from RabbitMQ: {data}")
+# Verified results arrive in bursts; their DB writes (mark the user verified,
+# spend one of the guild's tokens) are coalesced into one transaction per
+# VERIFICATION_WRITE_BATCH results or VERIFICATION_WRITE_FLUSH_SECONDS.
+VERIFICATION_WRITE_BATCH = int(os.getenv('VERIFICATION_WRITE_BATCH', '50'))
+VERIFICATION_WRITE_FLUSH_SECONDS = float(os.getenv('VERIFICATION_WRITE_FLUSH_SECONDS', '0.1'))
+
+_users_table = User.__table__
+_servers_table = Server.__table__
+
+MARK_USERS_VERIFIED = (
+    update(_users_table)
+    .where(_users_table.c.discord_id.in_(bindparam('discord_ids', expanding=True)))
+    .values(verification_status=True)
+)
+# verifications_count never goes below zero
+SPEND_VERIFICATIONS = (
+    update(_servers_table)
+    .where(_servers_table.c.server_id == bindparam('b_server_id'))
+    .where(_servers_table.c.verifications_count > 0)
+    .values(verifications_count=case(
+        (_servers_table.c.verifications_count > bindparam('b_spent'),
+         _servers_table.c.verifications_count - bindparam('b_spent')),
+        else_=0,
+    ))
+)
+
+
+def _apply_verification_writes(user_ids, spent_by_guild) -> None:
+    """One transaction for a batch of verified results. Blocking; use run_db."""
+    with session_scope() as session:
+        session.execute(MARK_USERS_VERIFIED, {'discord_ids': sorted(user_ids)})
+        session.execute(SPEND_VERIFICATIONS, [
+            {'b_server_id': guild_id, 'b_spent': spent}
+            for guild_id, spent in sorted(spent_by_guild.items())
+        ])
+
+
+class _PendingVerificationWrites:
+    """Buffer verified-result writes; add() returns a future that resolves
+    once the batch containing it has committed (so the delivery is only
+    acked after its writes are durable)."""
+
+    def __init__(self, batch_size: int, flush_seconds: float):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._user_ids = set()
+        self._spent = Counter()  # guild_id -> tokens used
+        self._waiters = []
+        self._flush_handle = None
+
+    def add(self, guild_id, user_id) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._user_ids.add(str(user_id))
+        self._spent[str(guild_id)] += 1
+        self._waiters.append(waiter)
+        if len(self._waiters) >= self.batch_size:
+            loop.create_task(self.flush())
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                self.flush_seconds, lambda: loop.create_task(self.flush())
+            )
+        return waiter
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._waiters:
+            return
+        user_ids, spent, waiters = self._user_ids, self._spent, self._waiters
+        self._user_ids, self._spent, self._waiters = set(), Counter(), []
+        try:
+            await run_db(_apply_verification_writes, user_ids, spent)
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        finally:
+            for guild_id in spent:
+                invalidate_server_config(guild_id)
+        logger.debug("Committed %s verification results across %s guilds", len(waiters), len(spent))
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+_verification_writes = _PendingVerificationWrites(VERIFICATION_WRITE_BATCH, VERIFICATION_WRITE_FLUSH_SECONDS)
+
+
+# Results are consumed concurrently (up to RABBITMQ_PREFETCH in flight); cap
+# role grants per guild so a burst for one server doesn't trip its
+# per-guild member-edit rate limit while other guilds proceed in parallel.
+ROLE_ASSIGN_CONCURRENCY_PER_GUILD = int(os.getenv('ROLE_ASSIGN_CONCURRENCY_PER_GUILD', '5'))
+_role_assign_slots = {}  # guild_id -> [semaphore, holders]
+
+
+@asynccontextmanager
+async def _guild_role_slot(guild_id):
+    slot = _role_assign_slots.get(guild_id)
+    if slot is None:
+        slot = _role_assign_slots[guild_id] = [asyncio.Semaphore(ROLE_ASSIGN_CONCURRENCY_PER_GUILD), 0]
+    slot[1] += 1
+    try:
+        async with slot[0]:
+            yield
+    finally:
+        slot[1] -= 1
+        if not slot[1]:
+            del _role_assign_slots[guild_id]
+
+
+async def process_verification_result(data: dict):
+    """Act on one decoded verification-result message from the queue."""
+    logger.debug("Received message from RabbitMQ: %s", data)
     if data['type'] == 'verification_verified':
-        guild_id = data['guild_id']
-        user_id = data['user_id']
-        role_id = data['role_id']
-        logger.debug(f"Decrementing verification count for guild {guild_id} after successful verification.")
-        await decrement_verifications_count(guild_id)
-        logger.info(f"Verification count decremented for guild {guild_id}.")
+        # Queue payloads carry string IDs; convert once here
+        guild_id = int(data['guild_id'])
+        user_id = int(data['user_id'])
+        role_id = int(data['role_id'])
+        # Verified users may press the button again to get the role back
+        _cooldown_cache.pop(str(user_id), None)
+        # Token spend + verified flag are batched; the role goes out meanwhile
+        written = _verification_writes.add(guild_id, user_id)
         # assign_role handles the success DM (custom or localized default) and
         # the failure-explanation DM, so no separate DM is sent here.
-        await assign_role(guild_id, user_id, role_id, notify_success_dm=True)
-        await update_user_verification_status(user_id, True)
+        async with _guild_role_slot(guild_id):
+            await assign_role(guild_id, user_id, role_id, notify_success_dm=True)
+        await written
+        logger.info(f"Verification count decremented for guild {guild_id}.")
     elif data['type'] == 'verification_canceled':
         guild_id = data['guild_id']
         user_id = data['user_id']
@@ -506,52 +729,121 @@ async def process_verification_result(message):
             if channel:
                 await channel.send(get_message(
                     "verification_canceled",
-                    locale=get_server_locale(guild_id),
+                    locale=await get_server_locale(guild_id),
                     user_mention=f"<@{user_id}>",
                 ))
 
-# Global variable to store the event loop
-main_loop = None
+class _AckBatcher:
+    """Ack processed deliveries with a single multiple=True frame per batch.
+
+    aio-pika runs message callbacks concurrently, so deliveries finish out of
+    order; only the longest fully-processed prefix of delivery tags on a
+    channel is ever acked. Flushes after `batch_size` completions or
+    `flush_seconds`, whichever comes first.
+    """
+
+    def __init__(self, batch_size: int, flush_seconds: float):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._pending = {}   # channel -> {delivery_tag: message | None (in progress) | False (settled)}
+        self._ack_upto = {}  # channel -> last message of the completed prefix
+        self._completed = 0
+        self._flush_handle = None
+
+    def track(self, message):
+        self._pending.setdefault(message.channel, {})[message.delivery_tag] = None
+
+    async def done(self, message, *, settled: bool = False):
+        """Mark a delivery finished. settled=True for deliveries already
+        rejected individually, which must not become an ack target."""
+        pending = self._pending.get(message.channel)
+        if pending is None or message.delivery_tag not in pending:
+            return
+        pending[message.delivery_tag] = False if settled else message
+        while pending:
+            tag, finished = next(iter(pending.items()))
+            if finished is None:
+                break
+            del pending[tag]
+            if finished is not False:
+                self._ack_upto[message.channel] = finished
+                self._completed += 1
+
+        if self._completed >= self.batch_size:
+            await self.flush()
+        elif self._completed and self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.flush_seconds, lambda: loop.create_task(self.flush())
+            )
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._completed = 0
+        for channel, message in list(self._ack_upto.items()):
+            del self._ack_upto[channel]
+            try:
+                await message.ack(multiple=True)
+            except Exception:
+                # Channel died (robust reconnect); the broker redelivers its
+                # unacked messages on the new channel.
+                logger.warning("Batched ack failed; dropping channel state.", exc_info=True)
+                self._pending.pop(channel, None)
+
 
 async def consume_queue():
-    global main_loop
-    main_loop = asyncio.get_running_loop()
+    """Consume verification results directly on the event loop (no consumer
+    thread, no per-message hop back onto the loop)."""
+    acks = _AckBatcher(RABBITMQ_ACK_BATCH, RABBITMQ_ACK_FLUSH_SECONDS)
 
-    def sync_callback(ch, method, properties, body):
+    async def on_message(message: aio_pika.abc.AbstractIncomingMessage):
+        acks.track(message)
         try:
-            json.loads(body)
-        except (json.JSONDecodeError, TypeError):
+            data = orjson.loads(message.body)
+        except orjson.JSONDecodeError:
             logger.error(f"Invalid JSON on {RABBITMQ_QUEUE_NAME}; dropping message")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            await message.reject(requeue=False)
+            await acks.done(message, settled=True)
             return
-        asyncio.run_coroutine_threadsafe(process_verification_result(body), main_loop)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        # Acked once processed; a failure is logged and dropped rather
+        # than requeued, so a poison message can't loop forever.
+        try:
+            await process_verification_result(data)
+        except Exception:
+            logger.exception("Error processing verification result")
+        await acks.done(message)
 
-    def do_blocking_consume():
-        while True:
-            connection = None
+    attempt = 0
+    while True:
+        connection = await _rabbitmq_connect_with_retry()
+        try:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=RABBITMQ_PREFETCH)
+            queue = await channel.declare_queue(RABBITMQ_QUEUE_NAME, durable=True)
+            await queue.consume(on_message)
+        except Exception:
+            # e.g. broker still starting or a queue declare mismatch: back off
+            # and start over rather than let the consumer task die
+            attempt += 1
+            delay = min(30.0, 2.0 * attempt)
+            logger.warning(f"RabbitMQ consumer setup failed; retrying in {delay:.1f}s (attempt {attempt})",
+                           exc_info=True)
             try:
-                connection = _rabbitmq_connect_with_retry(max_tries=0)
-                channel = connection.channel()
-                channel.queue_declare(queue=RABBITMQ_QUEUE_NAME, durable=True)
-                channel.basic_qos(prefetch_count=10)
-                logger.info(f"Listening for verification results on '{RABBITMQ_QUEUE_NAME}'...")
-                channel.basic_consume(queue=RABBITMQ_QUEUE_NAME, on_message_callback=sync_callback)
-                channel.start_consuming()
-            except (pika.exceptions.AMQPConnectionError, pika.exceptions.StreamLostError, OSError):
-                logger.warning("RabbitMQ consumer disconnected; reconnecting soon...", exc_info=True)
-                time.sleep(3)
+                await connection.close()
             except Exception:
-                logger.exception("Unexpected error in RabbitMQ consumer; restarting consumer loop")
-                time.sleep(3)
-            finally:
-                try:
-                    if connection and connection.is_open:
-                        connection.close()
-                except Exception:
-                    pass
+                pass
+            await asyncio.sleep(delay)
+            continue
 
-    await main_loop.run_in_executor(None, do_blocking_consume)
+        # From here aio-pika's robust connection restores the consumer itself
+        logger.info(f"Listening for verification results on '{RABBITMQ_QUEUE_NAME}'...")
+        try:
+            await asyncio.Future()  # consume until the bot shuts down
+        finally:
+            await acks.flush()
+            await connection.close()
 
 # -------------------------------------------------------------------
 # Persistent View for Instructions (survives restarts)
@@ -573,29 +865,36 @@ async def refresh_instruction_panels():
     """Re-edit every stored instruction panel so embeds/buttons reflect the
     current code and locale; clear references that 404 (deleted message or
     channel) so we stop retrying them forever."""
-    try:
+    def load_panels():
         with session_scope() as session:
-            servers_with_panels = (
-                session.query(Server)
-                .filter(
+            rows = session.execute(
+                select(
+                    Server.server_id,
+                    Server.instructions_channel_id,
+                    Server.instructions_message_id,
+                    Server.instructions_locale,
+                ).where(
                     Server.instructions_channel_id.isnot(None),
                     Server.instructions_message_id.isnot(None)
                 )
-                .all()
-            )
-            panels = [
-                {
-                    "server_id": s.server_id,
-                    "channel_id": s.instructions_channel_id,
-                    "message_id": s.instructions_message_id,
-                    "locale": s.instructions_locale,
-                }
-                for s in servers_with_panels
-            ]
+            ).all()
+        return [
+            {
+                "server_id": s.server_id,
+                "channel_id": s.instructions_channel_id,
+                "message_id": s.instructions_message_id,
+                "locale": s.instructions_locale,
+            }
+            for s in rows
+        ]
+
+    try:
+        panels = await run_db(load_panels)
     except Exception:
         logger.warning("Unable to enumerate servers for instruction panel refresh.", exc_info=True)
         return
 
+    stale = []
     for entry in panels:
         try:
             channel = bot.get_channel(int(entry["channel_id"]))
@@ -608,17 +907,30 @@ async def refresh_instruction_panels():
         except (discord.NotFound, discord.Forbidden) as e:
             # Message or channel is gone (or unreadable): clear the stale reference
             logger.info(f"Clearing stale instruction panel reference for guild {entry['server_id']}: {e}")
-            try:
-                with session_scope() as session:
-                    srv = session.query(Server).filter_by(server_id=entry["server_id"]).first()
-                    if srv:
-                        srv.instructions_channel_id = None
-                        srv.instructions_message_id = None
-            except Exception:
-                logger.warning(f"Could not clear stale panel reference for guild {entry['server_id']}.", exc_info=True)
+            stale.append(entry["server_id"])
         except Exception as e:
             logger.error(f"Error refreshing instruction panel for guild {entry['server_id']}: {e}")
 
+    if not stale:
+        return
+    # One UPDATE for every stale reference instead of a round-trip per guild
+    def clear_stale():
+        with session_scope() as session:
+            session.execute(
+                update(Server)
+                .where(Server.server_id.in_(stale))
+                .values(instructions_channel_id=None, instructions_message_id=None)
+                .execution_options(synchronize_session=False)
+            )
+
+    try:
+        await run_db(clear_stale)
+    except Exception:
+        logger.warning(f"Could not clear {len(stale)} stale panel references.", exc_info=True)
+        return
+    for server_id in stale:
+        invalidate_server_config(server_id)
+
 
 async def watch_update_trigger_file(trigger_path: str, poll_seconds: int):
     """Refresh all instruction panels when the trigger file appears.
@@ -660,6 +972,39 @@ async def on_ready():
 
     logger.info(f'Bot is ready. Logged in as {bot.user}')
 
+# Server + user lookup for verify/on_member_join, built once (see models.SERVER_BY_ID)
+SERVER_WITH_USER = (
+    select(Server, User)
+    .outerjoin(User, User.discord_id == bindparam('discord_id'))
+    .where(Server.server_id == bindparam('server_id'))
+    .limit(1)
+)
+
+
+def _load_server_and_user(guild_id: str, discord_id: str):
+    """(server, user) snapshots in one round-trip. Blocking; use run_db."""
+    with session_scope() as session:
+        # The server drives the query and the user (if any) rides along on
+        # an outer join.
+        row = session.execute(
+            SERVER_WITH_USER, {'server_id': guild_id, 'discord_id': discord_id}
+        ).first()
+        return (snapshot(row[0]), snapshot(row[1])) if row else (None, None)
+
+
+async def get_server_and_user(guild_id, discord_id):
+    """(server, user) snapshots: the user alone when the server is cached,
+    otherwise both in a single joined SELECT."""
+    key = str(guild_id)
+    server = _server_config_cache.get(key)
+    if server is not None:
+        return server, await run_db(get_user_verification_status, str(discord_id))
+    server, user = await run_db(_load_server_and_user, key, str(discord_id))
+    if server is not None:
+        _server_config_cache.set(key, server)
+    return server, user
+
+
 async def verify(interaction: discord.Interaction):
     """Plain function containing the verify flow; reusable by buttons and tests."""
     if interaction.guild is None:
@@ -669,120 +1014,123 @@ async def verify(interaction: discord.Interaction):
         return
 
     await interaction.response.defer(ephemeral=True)  # Acknowledge the interaction early
-    logger.debug(f"Received verify flow from user {interaction.user.id} in guild {interaction.guild.id}")
+    logger.debug("Received verify flow from user %s in guild %s", interaction.user.id, interaction.guild.id)
 
     try:
         guild_id = str(interaction.guild.id)
         user_id = str(interaction.user.id)
+        # Read the clock once; the age, cooldown and attempt timestamps all use it
+        now = datetime.now(timezone.utc)
 
-        with session_scope() as session:
-            user = session.query(User).filter_by(discord_id=user_id).first()
-            server_config = session.query(Server).filter_by(server_id=guild_id).first()
-            # Copy needed fields before session closes to avoid DetachedInstanceError
-            local_role_id = str(server_config.role_id) if server_config and server_config.role_id else None
-            loc = (server_config.instructions_locale
-                   if server_config and server_config.instructions_locale in LANGUAGE_CODES else None)
-
-            if not server_config or not local_role_id or not server_config.subscription_status:
-                await send_error_response(interaction, server_config, guild_id, loc)
-                return
-
-            # Check if the server is on tier_0
-            if server_config.tier == "tier_0":
-                if user and user.verification_status:
-                    # User is already verified, assign the role
-                    await assign_role(guild_id, interaction.user.id, server_config.role_id)
-                    await interaction.followup.send(get_message("already_verified", interaction, loc), ephemeral=True)
-                    return
-                else:
-                    # New users cannot verify in tier_0
-                    await interaction.followup.send(get_message("tier0_no_new_verifications", interaction, loc), ephemeral=True)
-                    return
-
-            # Check if the user is already verified
-            if user and user.verification_status:
-                # Decrypt the DOB to verify the age requirement
-                if user.dob:
-                    decrypted_dob = decrypt_dob(user.dob)  # Decrypt the stored DOB
-
-                    # Make the decrypted_dob timezone-aware (UTC)
-                    decrypted_dob = decrypted_dob.replace(tzinfo=timezone.utc)
+        cooldown = _get_cooldown(user_id)
+        if cooldown:
+            remaining, loc = cooldown
+            await interaction.followup.send(
+                get_message("cooldown_active", interaction, loc, seconds=remaining),
+                ephemeral=True,
+            )
+            return
 
-                    # Calculate the user's age in calendar years (leap-year safe)
-                    user_age = relativedelta(datetime.now(timezone.utc), decrypted_dob).years
+        server_config, user = await get_server_and_user(guild_id, user_id)
+        local_role_id = str(server_config.role_id) if server_config and server_config.role_id else None
+        loc = (server_config.instructions_locale
+               if server_config and server_config.instructions_locale in LANGUAGE_CODES else None)
 
-                    if user_age < server_config.minimum_age:
-                        await interaction.followup.send(
-                            get_message("age_below_minimum", interaction, loc, minimum_age=server_config.minimum_age),
-                            ephemeral=True,
-                        )
-                        return
+        if not server_config or not local_role_id or not server_config.subscription_status:
+            await send_error_response(interaction, server_config, guild_id, loc)
+            return
 
-                # Assign role if age requirement is met
-                await assign_role(guild_id, interaction.user.id, server_config.role_id)
+        # Check if the server is on tier_0
+        if server_config.tier == "tier_0":
+            if user and user.verification_status:
+                # User is already verified, assign the role
+                await assign_role(interaction.guild.id, interaction.user.id, int(local_role_id))
                 await interaction.followup.send(get_message("already_verified", interaction, loc), ephemeral=True)
                 return
+            else:
+                # New users cannot verify in tier_0
+                await interaction.followup.send(get_message("tier0_no_new_verifications", interaction, loc), ephemeral=True)
+                return
 
-            # Check cooldown if user exists and is not verified
-            if user and user.last_verification_attempt:
-                last_attempt = user.last_verification_attempt
-                if last_attempt.tzinfo is None:
-                    # sqlite returns naive datetimes even for tz-aware columns
-                    last_attempt = last_attempt.replace(tzinfo=timezone.utc)
-
-                current_time_utc = datetime.now(timezone.utc)
-                cooldown_end = last_attempt + timedelta(seconds=COOLDOWN_PERIOD)
+        # Check if the user is already verified
+        if user and user.verification_status:
+            # Decrypt the DOB to verify the age requirement
+            if user.dob:
+                decrypted_dob = decrypt_dob(user.dob)  # Decrypt the stored DOB
+                user_age = age_in_years(decrypted_dob, now)
 
-                if current_time_utc < cooldown_end:
-                    remaining = int((cooldown_end - current_time_utc).total_seconds()) + 1
-                    logger.debug(f"User {interaction.user.id} is in cooldown period until: {cooldown_end}")
+                if user_age < server_config.minimum_age:
                     await interaction.followup.send(
-                        get_message("cooldown_active", interaction, loc, seconds=remaining),
+                        get_message("age_below_minimum", interaction, loc, minimum_age=server_config.minimum_age),
                         ephemeral=True,
                     )
                     return
 
-            # Check if there are available verifications for the server
-            if server_config.verifications_count <= 0:
-                # Offer in-client token-pack purchases when SKUs are configured
-                packs_view = build_purchase_view(include_subscriptions=False, include_packs=True)
-                if packs_view:
-                    _record_purchase_context(interaction.user.id, guild_id)
-                    await interaction.followup.send(
-                        get_message("verification_limit_reached", interaction, loc),
-                        view=packs_view, ephemeral=True,
-                    )
-                else:
-                    await interaction.followup.send(get_message("verification_limit_reached", interaction, loc), ephemeral=True)
+            # Assign role if age requirement is met
+            await assign_role(interaction.guild.id, interaction.user.id, int(local_role_id))
+            await interaction.followup.send(get_message("already_verified", interaction, loc), ephemeral=True)
+            return
+
+        # Check cooldown if user exists and is not verified
+        if user and user.last_verification_attempt:
+            last_attempt = user.last_verification_attempt
+            if last_attempt.tzinfo is None:
+                # sqlite returns naive datetimes even for tz-aware columns
+                last_attempt = last_attempt.replace(tzinfo=timezone.utc)
+
+            cooldown_end = last_attempt + timedelta(seconds=COOLDOWN_PERIOD)
+
+            if now < cooldown_end:
+                remaining = int((cooldown_end - now).total_seconds()) + 1
+                logger.debug("User %s is in cooldown period until: %s", interaction.user.id, cooldown_end)
+                await interaction.followup.send(
+                    get_message("cooldown_active", interaction, loc, seconds=remaining),
+                    ephemeral=True,
+                )
                 return
 
-            # Record the attempt BEFORE generating the Stripe URL, so a rapid
-            # double-click can't create two verification sessions.
-            await track_verification_attempt(user_id)
+        # Check if there are available verifications for the server
+        if server_config.verifications_count <= 0:
+            # Offer in-client token-pack purchases when SKUs are configured
+            packs_view = build_purchase_view(include_subscriptions=False, include_packs=True)
+            if packs_view:
+                _record_purchase_context(interaction.user.id, guild_id)
+                await interaction.followup.send(
+                    get_message("verification_limit_reached", interaction, loc),
+                    view=packs_view, ephemeral=True,
+                )
+            else:
+                await interaction.followup.send(get_message("verification_limit_reached", interaction, loc), ephemeral=True)
+            return
 
-            # Directly generate a Stripe verification URL and send it (no second button)
-            logger.debug(f"Generating Stripe verification URL for user {interaction.user.id}")
-            verification_url = await generate_stripe_verification_url(
-                guild_id, interaction.user.id, local_role_id, str(interaction.channel.id)
-            )
-            if not verification_url:
-                logger.error(f"Failed to generate Stripe verification URL for user {interaction.user.id}")
-                await interaction.followup.send(get_message("verification_link_failed", interaction, loc), ephemeral=True)
-                return
+        # Record the attempt BEFORE generating the Stripe URL, so a rapid
+        # double-click can't create two verification sessions.
+        await track_verification_attempt(user_id, now)
+        _record_cooldown(user_id, loc)
 
-            bot.loop.create_task(track_command_usage(guild_id, interaction.user.id, "verify"))
+        # Directly generate a Stripe verification URL and send it (no second button)
+        logger.debug("Generating Stripe verification URL for user %s", interaction.user.id)
+        verification_url = await generate_stripe_verification_url(
+            guild_id, interaction.user.id, local_role_id, str(interaction.channel.id)
+        )
+        if not verification_url:
+            logger.error(f"Failed to generate Stripe verification URL for user {interaction.user.id}")
+            await interaction.followup.send(get_message("verification_link_failed", interaction, loc), ephemeral=True)
+            return
 
-            await interaction.followup.send(
-                get_message("verification_link", interaction, loc, url=verification_url),
-                ephemeral=True,
-            )
-            logger.debug(f"Sent verification link to user {interaction.user.id}")
+        track_command_usage(guild_id, interaction.user.id, "verify")
+
+        await interaction.followup.send(
+            get_message("verification_link", interaction, loc, url=verification_url),
+            ephemeral=True,
+        )
+        logger.debug("Sent verification link to user %s", interaction.user.id)
 
     except Exception as e:
         logger.error(f"Unexpected error in verify command: {str(e)}", exc_info=True)
         await interaction.followup.send(get_message("unexpected_error", interaction), ephemeral=True)
 
-    logger.debug(f"Verify flow completed for user {interaction.user.id}")
+    logger.debug("Verify flow completed for user %s", interaction.user.id)
 
 @bot.tree.command(name="verifyme", description="Start the age verification process")
 @app_commands.guild_only()
@@ -804,27 +1152,24 @@ async def on_member_join(member: discord.Member):
         guild_id = str(member.guild.id)
         discord_id = str(member.id)
 
-        with session_scope() as session:
-            server = session.query(Server).filter_by(server_id=guild_id).first()
-            if not server or not server.role_id or not server.subscription_status:
-                return
-            if not server.auto_verify_new_members:
-                return
+        server, user = await get_server_and_user(guild_id, discord_id)
+        if not server or not server.role_id or not server.subscription_status:
+            return
+        if not server.auto_verify_new_members:
+            return
 
-            user = session.query(User).filter_by(discord_id=discord_id).first()
-            if not user or not user.verification_status:
-                return
+        if not user or not user.verification_status:
+            return
 
-            # Same age gate as the manual verify path
-            if user.dob:
-                decrypted_dob = decrypt_dob(user.dob).replace(tzinfo=timezone.utc)
-                user_age = relativedelta(datetime.now(timezone.utc), decrypted_dob).years
-                if user_age < server.minimum_age:
-                    return
+        # Same age gate as the manual verify path
+        if user.dob:
+            user_age = age_in_years(decrypt_dob(user.dob), datetime.now(timezone.utc))
+            if user_age < server.minimum_age:
+                return
 
-            role_id = server.role_id
+        role_id = int(server.role_id)
 
-        assigned = await assign_role(guild_id, discord_id, role_id,
+        assigned = await assign_role(member.guild.id, member.id, role_id,
                                      notify_success_dm=True, success_dm_key="dm_auto_verified")
         if assigned:
             logger.info(f"Auto-verified user {discord_id} in guild {guild_id} on join.")
@@ -879,71 +1224,46 @@ def _aware(dt):
     return dt
 
 
-def _resolve_pack_guild(session, user_id: str):
-    """Which server should a user-scoped token pack credit? Purchase context
-    first, then sole-owner fallback."""
-    guild_id = _get_purchase_context(user_id)
-    if guild_id:
-        return guild_id
-    owned = session.query(Server).filter_by(owner_id=str(user_id), subscription_status=True).all()
+def _sole_owned_guild(session, user_id: str):
+    """Fallback target for a user-scoped token pack: the one active server
+    the user owns, else None."""
+    owned = session.execute(
+        select(Server.server_id)
+        .where(Server.owner_id == str(user_id), Server.subscription_status == True)
+        .limit(2)
+    ).scalars().all()
     if len(owned) == 1:
-        return owned[0].server_id
+        return owned[0]
     return None
 
 
-async def process_entitlement(entitlement) -> None:
-    """Apply one entitlement (from a gateway event or the startup sweep).
-    Idempotent: re-processing the same entitlement state never double-grants."""
-    sku_id = str(entitlement.sku_id)
-
-    # --- Consumable token packs ---
-    if sku_id in billing.SKU_ID_TO_EXTRA_TOKENS:
-        if getattr(entitlement, 'consumed', False):
-            return
-        tokens = billing.SKU_ID_TO_EXTRA_TOKENS[sku_id]
-        user_id = str(entitlement.user_id) if entitlement.user_id else None
-        granted_guild = None
-        with session_scope() as session:
-            guild_id = str(entitlement.guild_id) if entitlement.guild_id else (
-                user_id and _resolve_pack_guild(session, user_id)
+def _grant_token_pack(entitlement_id, guild_id, user_id, tokens):
+    """Credit a token pack to guild_id, or to the user's sole active server
+    when there is none. Returns the credited guild id, or None if the pack
+    can't be attributed. Blocking; use run_db."""
+    with session_scope() as session:
+        if not guild_id and user_id:
+            guild_id = _sole_owned_guild(session, user_id)
+        if not guild_id:
+            logger.error(
+                f"Token-pack entitlement {entitlement_id} (user {user_id}) has no "
+                f"attributable guild; leaving unconsumed for support follow-up."
             )
-            if not guild_id:
-                logger.error(
-                    f"Token-pack entitlement {entitlement.id} (user {user_id}) has no "
-                    f"attributable guild; leaving unconsumed for support follow-up."
-                )
-                return
-            server = session.query(Server).filter_by(server_id=str(guild_id)).first()
-            if not server:
-                logger.error(f"Token-pack entitlement {entitlement.id}: guild {guild_id} has no server row; leaving unconsumed.")
-                return
-            server.verifications_count = (server.verifications_count or 0) + tokens
-            granted_guild = guild_id
-        # Consume only after the grant committed, so a crash can't burn the
-        # purchase; re-processing before consume is idempotent via 'consumed'.
-        try:
-            await entitlement.consume()
-            logger.info(f"Granted {tokens} extra tokens to guild {granted_guild} and consumed entitlement {entitlement.id}.")
-        except Exception:
-            logger.error(f"Failed to consume entitlement {entitlement.id} after granting tokens.", exc_info=True)
-        return
+            return None
+        server = session.execute(SERVER_BY_ID, {'server_id': str(guild_id)}).scalar()
+        if not server:
+            logger.error(f"Token-pack entitlement {entitlement_id}: guild {guild_id} has no server row; leaving unconsumed.")
+            return None
+        server.verifications_count = (server.verifications_count or 0) + tokens
+    return str(guild_id)
 
-    # --- Guild subscriptions ---
-    tier_info = billing.SKU_ID_TO_TIER.get(sku_id)
-    if not tier_info:
-        logger.warning(f"Entitlement {entitlement.id} references unknown SKU {sku_id}; ignoring.")
-        return
-    if not entitlement.guild_id:
-        logger.warning(f"Subscription entitlement {entitlement.id} has no guild_id; ignoring.")
-        return
 
+def _apply_guild_entitlement(entitlement, tier_info, *, ends_at, active, now) -> None:
+    """Write one guild-subscription entitlement to its Server row (creating
+    the row if needed). Blocking; use run_db."""
     guild_id = str(entitlement.guild_id)
-    ends_at = _aware(entitlement.ends_at)
-    now = datetime.now(timezone.utc)
-    active = not getattr(entitlement, 'deleted', False) and (ends_at is None or ends_at > now)
-
     with session_scope() as session:
-        server = session.query(Server).filter_by(server_id=guild_id).first()
+        server = session.execute(SERVER_BY_ID, {'server_id': guild_id}).scalar()
         if not server:
             server = Server(
                 server_id=guild_id,
@@ -970,12 +1290,59 @@ async def process_entitlement(entitlement) -> None:
             period_start=now if new_period else None,
         )
         server.payment_provider = 'discord'
-        server.discord_sku_id = sku_id
+        server.discord_sku_id = str(entitlement.sku_id)
         server.discord_entitlement_id = str(entitlement.id)
         server.entitlement_ends_at = ends_at
         if not server.subscription_start_date:
             server.subscription_start_date = _aware(entitlement.starts_at) or now
 
+
+async def process_entitlement(entitlement) -> None:
+    """Apply one entitlement (from a gateway event or the startup sweep).
+    Idempotent: re-processing the same entitlement state never double-grants."""
+    sku_id = str(entitlement.sku_id)
+
+    # --- Consumable token packs ---
+    if sku_id in billing.SKU_ID_TO_EXTRA_TOKENS:
+        if getattr(entitlement, 'consumed', False):
+            return
+        tokens = billing.SKU_ID_TO_EXTRA_TOKENS[sku_id]
+        user_id = str(entitlement.user_id) if entitlement.user_id else None
+        # Purchase context first (in-memory, read here on the loop), then
+        # the sole-owner fallback inside the DB helper
+        guild_id = str(entitlement.guild_id) if entitlement.guild_id else (
+            user_id and _get_purchase_context(user_id)
+        )
+        granted_guild = await run_db(_grant_token_pack, entitlement.id, guild_id, user_id, tokens)
+        if not granted_guild:
+            return
+        invalidate_server_config(granted_guild)
+        # Consume only after the grant committed, so a crash can't burn the
+        # purchase; re-processing before consume is idempotent via 'consumed'.
+        try:
+            await entitlement.consume()
+            logger.info(f"Granted {tokens} extra tokens to guild {granted_guild} and consumed entitlement {entitlement.id}.")
+        except Exception:
+            logger.error(f"Failed to consume entitlement {entitlement.id} after granting tokens.", exc_info=True)
+        return
+
+    # --- Guild subscriptions ---
+    tier_info = billing.SKU_ID_TO_TIER.get(sku_id)
+    if not tier_info:
+        logger.warning(f"Entitlement {entitlement.id} references unknown SKU {sku_id}; ignoring.")
+        return
+    if not entitlement.guild_id:
+        logger.warning(f"Subscription entitlement {entitlement.id} has no guild_id; ignoring.")
+        return
+
+    guild_id = str(entitlement.guild_id)
+    ends_at = _aware(entitlement.ends_at)
+    now = datetime.now(timezone.utc)
+    active = not getattr(entitlement, 'deleted', False) and (ends_at is None or ends_at > now)
+
+    await run_db(_apply_guild_entitlement, entitlement, tier_info, ends_at=ends_at, active=active, now=now)
+    invalidate_server_config(guild_id)
+
     logger.info(
         f"Entitlement {entitlement.id} applied to guild {guild_id}: "
         f"{tier_info['tier']}, active={active}, ends_at={ends_at}."
@@ -1001,14 +1368,28 @@ async def on_entitlement_update(entitlement):
 @bot.event
 async def on_entitlement_delete(entitlement):
     """Entitlement removed entirely (e.g. refund): deactivate the server."""
-    try:
+    # One UPDATE ... RETURNING instead of loading the row to flip a flag
+    stmt = (
+        update(Server)
+        .where(
+            Server.discord_entitlement_id == str(entitlement.id),
+            Server.payment_provider == 'discord',
+        )
+        .values(subscription_status=False)
+        .returning(Server.server_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    def db_update():
         with session_scope() as session:
-            server = session.query(Server).filter_by(
-                discord_entitlement_id=str(entitlement.id), payment_provider='discord'
-            ).first()
-            if server:
-                server.subscription_status = False
-                logger.info(f"Entitlement {entitlement.id} deleted; guild {server.server_id} deactivated.")
+            return session.execute(stmt).scalars().all()
+
+    try:
+        server_ids = await run_db(db_update)
+        # After the commit, so a concurrent read can't re-cache the old row
+        for server_id in server_ids:
+            invalidate_server_config(server_id)
+            logger.info(f"Entitlement {entitlement.id} deleted; guild {server_id} deactivated.")
     except Exception:
         logger.error("Exception in on_entitlement_delete", exc_info=True)
 
@@ -1029,47 +1410,81 @@ async def reconcile_entitlements():
         logger.error("Entitlement reconciliation sweep failed.", exc_info=True)
 
 
-async def track_verification_attempt(discord_id):
-    logger.debug(f"Tracking verification attempt for user {discord_id}")
-    try:
+async def track_verification_attempt(discord_id, now=None):
+    logger.debug("Tracking verification attempt for user %s", discord_id)
+    now = now or datetime.now(timezone.utc)
+
+    stmt = upsert(User).values(
+        discord_id=str(discord_id),
+        verification_status=False,
+        last_verification_attempt=now,
+    ).on_conflict_do_update(
+        index_elements=[User.discord_id], set_={'last_verification_attempt': now}
+    )
+
+    def db_update():
         with session_scope() as session:
-            user = session.query(User).filter_by(discord_id=str(discord_id)).first()
-            if user:
-                user.last_verification_attempt = datetime.now(timezone.utc)
-            else:
-                new_user = User(
-                    discord_id=str(discord_id),
-                    verification_status=False,
-                    last_verification_attempt=datetime.now(timezone.utc)
-                )
-                session.add(new_user)
-            session.commit()
+            session.execute(stmt)
+
+    try:
+        await run_db(db_update)
         logger.info(f"Successfully tracked verification attempt for user {discord_id}")
     except Exception as e:
         logger.error(f"Error tracking verification attempt for user {discord_id}: {str(e)}", exc_info=True)
 
-async def track_command_usage(server_id, user_id, command):
+# CommandUsage rows are analytics only, so they are buffered in memory and
+# written as one multi-row INSERT per flush instead of a transaction per
+# command. A flush happens when the buffer fills or COMMAND_USAGE_FLUSH_SECONDS
+# after the first buffered row, whichever comes first (and on shutdown).
+COMMAND_USAGE_FLUSH_SIZE = int(os.getenv('COMMAND_USAGE_FLUSH_SIZE', '50'))
+COMMAND_USAGE_FLUSH_SECONDS = float(os.getenv('COMMAND_USAGE_FLUSH_SECONDS', '5'))
+_command_usage_buffer: list = []
+_command_usage_flush_handle = None
+
+
+def track_command_usage(server_id, user_id, command):
+    """Buffer one CommandUsage row; never waits on the database.
+
+    Returns the flush task when this row filled the buffer (else None), so
+    callers that care can await the write.
+    """
+    global _command_usage_flush_handle
+    _command_usage_buffer.append({
+        'server_id': str(server_id),
+        'user_id': str(user_id),
+        'command': command,
+        'timestamp': datetime.now(timezone.utc),
+    })
+    loop = asyncio.get_running_loop()
+    if len(_command_usage_buffer) >= COMMAND_USAGE_FLUSH_SIZE:
+        return loop.create_task(flush_command_usage())
+    if _command_usage_flush_handle is None:
+        _command_usage_flush_handle = loop.call_later(
+            COMMAND_USAGE_FLUSH_SECONDS, lambda: loop.create_task(flush_command_usage())
+        )
+    return None
+
+
+def _insert_command_usage(rows) -> None:
+    with session_scope() as session:
+        session.execute(insert(CommandUsage), rows)
+
+
+async def flush_command_usage():
+    """Write all buffered CommandUsage rows in a single multi-row INSERT."""
+    global _command_usage_flush_handle
+    if _command_usage_flush_handle is not None:
+        _command_usage_flush_handle.cancel()
+        _command_usage_flush_handle = None
+    if not _command_usage_buffer:
+        return
+    rows = _command_usage_buffer[:]
+    _command_usage_buffer.clear()
     try:
-        with session_scope() as session:
-            new_usage = CommandUsage(
-                server_id=str(server_id),
-                user_id=str(user_id),
-                command=command,
-                timestamp=datetime.now(timezone.utc)
-            )
-            session.add(new_usage)
-            session.commit()
-        logger.debug(f"Successfully tracked command usage for user {user_id}")
+        await run_db(_insert_command_usage, rows)
+        logger.debug("Flushed %s command usage rows", len(rows))
     except Exception as e:
-        logger.error(f"Error tracking command usage for user {user_id}: {str(e)}", exc_info=True)
-
-def is_user_in_cooldown(last_verification_attempt):
-    if last_verification_attempt:
-        cooldown_end = last_verification_attempt + timedelta(seconds=COOLDOWN_PERIOD)
-        current_time_utc = datetime.now(timezone.utc)
-        logger.debug(f"Current time: {current_time_utc}, Cooldown end time: {cooldown_end}")
-        return current_time_utc < cooldown_end
-    return False
+        logger.error(f"Error flushing {len(rows)} command usage rows: {str(e)}", exc_info=True)
 
 async def send_error_response(interaction, server_config, guild_id, loc=None):
     def _embed(title_key: str, desc_key: str, color: discord.Color) -> discord.Embed:
@@ -1114,24 +1529,24 @@ async def setupVerify(interaction: discord.Interaction, role: discord.Role, mini
         return
 
     guild_id = str(interaction.guild.id)
-    with session_scope() as session:
-        server_config = session.query(Server).filter_by(server_id=guild_id).first()
+    owner_id = str(interaction.guild.owner_id)
+
+    fields = {'role_id': str(role.id), 'minimum_age': minimum_age}
+    if unverified_role is not None:
+        fields['unverified_role_id'] = str(unverified_role.id)
+    stmt = upsert(Server).values(
+        server_id=guild_id,
+        owner_id=owner_id,
+        subscription_status=False,
+        **fields,
+    ).on_conflict_do_update(index_elements=[Server.server_id], set_=fields)
+
+    def save():
+        with session_scope() as session:
+            session.execute(stmt)
 
-        if not server_config:
-            new_server = Server(
-                server_id=guild_id,
-                owner_id=str(interaction.guild.owner_id),
-                role_id=str(role.id),
-                minimum_age=minimum_age,
-                subscription_status=False,
-                unverified_role_id=(str(unverified_role.id) if unverified_role else None),
-            )
-            session.add(new_server)
-        else:
-            server_config.role_id = str(role.id)
-            server_config.minimum_age = minimum_age
-            if unverified_role is not None:
-                server_config.unverified_role_id = str(unverified_role.id)
+    await run_db(save)
+    invalidate_server_config(guild_id)
 
     msg = get_message("setup_success", interaction, role=role.name, minimum_age=minimum_age)
     if unverified_role:
@@ -1153,7 +1568,7 @@ async def get_subscription(interaction: discord.Interaction):
         await interaction.response.send_message(get_message("no_permission", interaction), ephemeral=True)
         return
 
-    loc = get_server_locale(interaction.guild.id)
+    loc = await get_server_locale(interaction.guild.id)
     purchase_view = build_purchase_view()
     if purchase_view:
         # In-client purchase via Discord's storefront (Phase 5). The
@@ -1172,54 +1587,52 @@ async def get_subscription(interaction: discord.Interaction):
 async def server_info(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
     
-    with session_scope() as session:
-        server_config = session.query(Server).filter_by(server_id=guild_id).first()
+    server_config = await get_server_config_cached(guild_id)
 
-        if not server_config:
-            await interaction.response.send_message(get_message("not_configured_admin", interaction), ephemeral=True)
-            return
+    if not server_config:
+        await interaction.response.send_message(get_message("not_configured_admin", interaction), ephemeral=True)
+        return
 
-        verification_role = interaction.guild.get_role(int(server_config.role_id)) if server_config.role_id else None
-        tier = server_config.tier
-        max_verifications = tier_requirements.get(tier, "Tier not set")  # Provide a default value if tier is None
+    verification_role = interaction.guild.get_role(int(server_config.role_id)) if server_config.role_id else None
+    tier = server_config.tier
+    max_verifications = tier_requirements.get(tier, "Tier not set")  # Provide a default value if tier is None
 
-        embed = discord.Embed(title="Server Verification Configuration", color=discord.Color.blue())
-        embed.add_field(name="Verification Role", value=verification_role.name if verification_role else "Not set", inline=False)
-        embed.add_field(name="Server's Minimum Age", value=server_config.minimum_age, inline=False)
-        embed.add_field(name="Subscription Tier", value=tier if tier else "Not set", inline=True)
-        embed.add_field(name="Subscription Status", value="Active" if server_config.subscription_status else "Inactive", inline=True)
-        embed.add_field(name="Verifications Remaining", value=str(server_config.verifications_count), inline=True)
-        embed.add_field(name="Max Verifications/Month", value=str(max_verifications), inline=True)
+    embed = discord.Embed(title="Server Verification Configuration", color=discord.Color.blue())
+    embed.add_field(name="Verification Role", value=verification_role.name if verification_role else "Not set", inline=False)
+    embed.add_field(name="Server's Minimum Age", value=server_config.minimum_age, inline=False)
+    embed.add_field(name="Subscription Tier", value=tier if tier else "Not set", inline=True)
+    embed.add_field(name="Subscription Status", value="Active" if server_config.subscription_status else "Inactive", inline=True)
+    embed.add_field(name="Verifications Remaining", value=str(server_config.verifications_count), inline=True)
+    embed.add_field(name="Max Verifications/Month", value=str(max_verifications), inline=True)
 
-        if server_config.verifications_count == 0:
-            embed.add_field(name="Warning", value="You have reached the maximum number of verifications for this month.", inline=False)
+    if server_config.verifications_count == 0:
+        embed.add_field(name="Warning", value="You have reached the maximum number of verifications for this month.", inline=False)
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # @bot.tree.command(name="subscription_status", description="Show detailed information about the server's verification subscription")
 # @app_commands.checks.has_permissions(administrator=True)
 async def subscription_status(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
 
-    with session_scope() as session:
-        server_config = session.query(Server).filter_by(server_id=guild_id).first()
+    server_config = await get_server_config_cached(guild_id)
 
-        if not server_config:
-            await interaction.response.send_message("This server is not configured for verification.", ephemeral=True)
-            return
+    if not server_config:
+        await interaction.response.send_message("This server is not configured for verification.", ephemeral=True)
+        return
 
-        current_tier = server_config.tier
+    current_tier = server_config.tier
 
-        embed = discord.Embed(title="Verification Subscription Status", color=discord.Color.green())
-        embed.add_field(name="Current Tier", value=current_tier, inline=True)
-        embed.add_field(name="Subscription Status", value="Active" if server_config.subscription_status else "Inactive", inline=True)
-        embed.add_field(name="Verifications Count", value=str(server_config.verifications_count), inline=True)
-        embed.add_field(name="Max Verifications/Month", value=str(tier_requirements[current_tier]), inline=True)
+    embed = discord.Embed(title="Verification Subscription Status", color=discord.Color.green())
+    embed.add_field(name="Current Tier", value=current_tier, inline=True)
+    embed.add_field(name="Subscription Status", value="Active" if server_config.subscription_status else "Inactive", inline=True)
+    embed.add_field(name="Verifications Count", value=str(server_config.verifications_count), inline=True)
+    embed.add_field(name="Max Verifications/Month", value=str(tier_requirements[current_tier]), inline=True)
 
-        if server_config.verifications_count <=0:
-            embed.add_field(name="⚠️ Warning", value="Current tier has reached the maximum number of verifications. Please upgrade.", inline=False)
+    if server_config.verifications_count <=0:
+        embed.add_field(name="⚠️ Warning", value="Current tier has reached the maximum number of verifications. Please upgrade.", inline=False)
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # @bot.tree.command(name="verification_logs", description="View recent verification actions")
 # @app_commands.checks.has_permissions(administrator=True)
@@ -1277,51 +1690,42 @@ async def instructions(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
     channel_to_use = interaction.channel
 
-    with session_scope() as session:
-        server = session.query(Server).filter_by(server_id=guild_id).first()
-        loc = (server.instructions_locale
-               if server and server.instructions_locale in LANGUAGE_CODES else None)
-        embed = build_instructions_embed(loc)
-        view = InstructionsPersistentView()
-
-        # Try updating existing panel if we have stored IDs
-        if server and server.instructions_channel_id and server.instructions_message_id:
-            try:
-                ch = interaction.guild.get_channel(int(server.instructions_channel_id))
-                if ch is None:
-                    ch = bot.get_channel(int(server.instructions_channel_id))
-                if ch is not None:
-                    # Requested log format
-                    logger.info(f"Reinitializing instruction panel for guild ID: {guild_id}")
-                    msg = await ch.fetch_message(int(server.instructions_message_id))
-                    await msg.edit(embed=embed, view=view)
-                    await interaction.response.send_message(get_message("instructions_updated", interaction, loc), ephemeral=True)
-                    return
-            except discord.NotFound:
-                # Stale reference: the message or channel was deleted. Clear it
-                # so future startups stop trying to re-edit it.
-                logger.info(f"Stale instruction panel reference for guild {guild_id}; clearing and posting new.")
-                server.instructions_channel_id = None
-                server.instructions_message_id = None
-            except Exception as e:
-                logger.info(f"Existing instructions message not found or not editable; posting new. Reason: {e}")
-
-        # Post a new message and store IDs
-        sent = await channel_to_use.send(embed=embed, view=view)
-        if not server:
-            server = Server(
-                server_id=guild_id,
-                owner_id=str(interaction.guild.owner_id),
-                role_id=None,
-                tier="tier_0",
-                subscription_status=False,
-                minimum_age=18,
-            )
-            session.add(server)
-        server.instructions_channel_id = str(sent.channel.id)
-        server.instructions_message_id = str(sent.id)
-        # Respond to the admin
-        await interaction.response.send_message(get_message("instructions_posted", interaction, loc), ephemeral=True)
+    # Uncached read: the stored panel ids must be current to edit, not repost
+    server = await run_db(get_server_config, guild_id)
+    loc = (server.instructions_locale
+           if server and server.instructions_locale in LANGUAGE_CODES else None)
+    embed = build_instructions_embed(loc)
+    view = InstructionsPersistentView()
+
+    # Try updating existing panel if we have stored IDs
+    if server and server.instructions_channel_id and server.instructions_message_id:
+        try:
+            ch = interaction.guild.get_channel(int(server.instructions_channel_id))
+            if ch is None:
+                ch = bot.get_channel(int(server.instructions_channel_id))
+            if ch is not None:
+                # Requested log format
+                logger.info(f"Reinitializing instruction panel for guild ID: {guild_id}")
+                msg = await ch.fetch_message(int(server.instructions_message_id))
+                await msg.edit(embed=embed, view=view)
+                await interaction.response.send_message(get_message("instructions_updated", interaction, loc), ephemeral=True)
+                return
+        except discord.NotFound:
+            # Stale reference: the message or channel was deleted. The new
+            # panel's IDs below replace it, so startups stop re-editing it.
+            logger.info(f"Stale instruction panel reference for guild {guild_id}; clearing and posting new.")
+        except Exception as e:
+            logger.info(f"Existing instructions message not found or not editable; posting new. Reason: {e}")
+
+    # Post a new message and store IDs (creating the Server row if needed)
+    sent = await channel_to_use.send(embed=embed, view=view)
+    await save_server_fields(
+        interaction,
+        instructions_channel_id=str(sent.channel.id),
+        instructions_message_id=str(sent.id),
+    )
+    # Respond to the admin
+    await interaction.response.send_message(get_message("instructions_posted", interaction, loc), ephemeral=True)
 
 # -------------------------------------------------------------------
 # /settings — paged admin settings view (pattern ported from VRCVerify)
@@ -1340,9 +1744,7 @@ class MinimumAgeModal(discord.ui.Modal, title="Set minimum age"):
             await interaction.response.send_message(get_message("min_age_invalid", interaction), ephemeral=True)
             return
         age = int(raw)
-        with session_scope() as session:
-            srv = _get_or_create_server(session, interaction)
-            srv.minimum_age = age
+        await save_server_fields(interaction, minimum_age=age)
         self.parent_view.minimum_age = age
         await interaction.response.send_message(
             get_message("min_age_saved", interaction, minimum_age=age), ephemeral=True
@@ -1376,25 +1778,22 @@ class CustomMessageModal(discord.ui.Modal, title="Custom success message"):
         if len(sanitized) > 1000:
             await interaction.response.send_message(get_message("custom_msg_too_long", interaction), ephemeral=True)
             return
-        with session_scope() as session:
-            srv = _get_or_create_server(session, interaction)
-            srv.custom_verification_message = sanitized
+        await save_server_fields(interaction, custom_verification_message=sanitized)
         self.parent_view.custom_message = sanitized
         await interaction.response.send_message(get_message("custom_msg_saved", interaction), ephemeral=True)
 
 
-def _get_or_create_server(session, interaction: discord.Interaction) -> Server:
-    srv = session.query(Server).filter_by(server_id=str(interaction.guild.id)).first()
-    if not srv:
-        srv = Server(
-            server_id=str(interaction.guild.id),
-            owner_id=str(interaction.guild.owner_id),
-            tier="tier_0",
-            subscription_status=False,
-            minimum_age=18,
-        )
-        session.add(srv)
-    return srv
+def _save_server_fields(interaction: discord.Interaction, **fields) -> None:
+    """Upsert the guild's Server row with fields. Blocking; use run_db."""
+    stmt = upsert(Server).values(
+        server_id=str(interaction.guild.id),
+        owner_id=str(interaction.guild.owner_id),
+        tier="tier_0",
+        subscription_status=False,
+        minimum_age=18,
+    ).values(**fields).on_conflict_do_update(index_elements=[Server.server_id], set_=fields)
+    with session_scope() as session:
+        session.execute(stmt)
 
 
 class PagedSettingsView(discord.ui.View):
@@ -1527,9 +1926,7 @@ class PagedSettingsView(discord.ui.View):
                 await interaction.response.send_modal(CustomMessageModal(self))
 
             async def on_clear_message(interaction: discord.Interaction):
-                with session_scope() as session:
-                    srv = _get_or_create_server(session, interaction)
-                    srv.custom_verification_message = None
+                await save_server_fields(interaction, custom_verification_message=None)
                 self.custom_message = None
                 new_view = self._rebuild(interaction, self.page)
                 await interaction.response.edit_message(content=new_view.render_content(), view=new_view)
@@ -1580,11 +1977,12 @@ class PagedSettingsView(discord.ui.View):
             await interaction.response.edit_message(content=new_view.render_content(), view=new_view)
 
         async def on_save(interaction: discord.Interaction):
-            with session_scope() as session:
-                srv = _get_or_create_server(session, interaction)
-                srv.instructions_locale = str(self.instr_locale)
-                srv.auto_verify_new_members = bool(self.auto_verify)
-                srv.unverified_role_id = self.unverified_role_id
+            await save_server_fields(
+                interaction,
+                instructions_locale=str(self.instr_locale),
+                auto_verify_new_members=bool(self.auto_verify),
+                unverified_role_id=self.unverified_role_id,
+            )
             ctx2 = SimpleNamespace(locale=self.instr_locale if self.instr_locale in LANGUAGE_CODES else "en-US")
             await interaction.response.edit_message(content=get_message("settings_saved", ctx2), view=None)
 
@@ -1600,14 +1998,13 @@ class PagedSettingsView(discord.ui.View):
 @app_commands.guild_only()
 @app_commands.checks.has_permissions(administrator=True)
 async def settings(interaction: discord.Interaction):
-    with session_scope() as session:
-        srv = session.query(Server).filter_by(server_id=str(interaction.guild.id)).first()
-        minimum_age = srv.minimum_age if srv and srv.minimum_age else 18
-        instr_locale = (srv.instructions_locale
-                        if srv and srv.instructions_locale in LANGUAGE_CODES else "en-US")
-        auto_verify = bool(srv.auto_verify_new_members) if srv and srv.auto_verify_new_members is not None else True
-        custom_message = srv.custom_verification_message if srv else None
-        unverified_role_id = srv.unverified_role_id if srv else None
+    srv = await get_server_config_cached(interaction.guild.id)
+    minimum_age = srv.minimum_age if srv and srv.minimum_age else 18
+    instr_locale = (srv.instructions_locale
+                    if srv and srv.instructions_locale in LANGUAGE_CODES else "en-US")
+    auto_verify = bool(srv.auto_verify_new_members) if srv and srv.auto_verify_new_members is not None else True
+    custom_message = srv.custom_verification_message if srv else None
+    unverified_role_id = srv.unverified_role_id if srv else None
 
     view = PagedSettingsView(
         minimum_age=minimum_age,
@@ -10,15 +10,20 @@ This repo is scoped to verify_me_database ONLY (DATABASE_URL_VERIFICATION).
 Never add an engine for any other database here.
 
 Schema changes are managed with Alembic (alembic/ at the repo root), not
-create_all at import time. init_db() exists for tests and local sqlite use.
+create_all at import time. init_db() exists for tests and local sqlite use
+(AUTO_CREATE_TABLES=1 runs it at import for throwaway dev databases).
 """
 import os
 from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone
+from types import SimpleNamespace
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime
+from sqlalchemy import bindparam, create_engine, func, select, text, Column, Index, Integer, String, Boolean, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 load_dotenv()
 
@@ -26,15 +31,89 @@ DATABASE_URL = os.getenv('DATABASE_URL_VERIFICATION')
 if not DATABASE_URL:
     raise EnvironmentError("DATABASE_URL_VERIFICATION is not set")
 
-engine = create_engine(DATABASE_URL)
+
+def _engine_options(url: str) -> dict:
+    # An in-memory sqlite database lives inside a single connection; share
+    # it across threads so work run on executors sees the same tables.
+    if url.startswith('sqlite') and ':memory:' in url:
+        return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+    if url.startswith('sqlite'):
+        return {}
+    # Every service process gets its own pool, so keep the per-process
+    # ceiling (size + overflow) well under Postgres' max_connections.
+    # pre_ping drops connections the server closed while idle instead of
+    # failing the next query (turn it off behind PgBouncer in transaction
+    # mode, with a short recycle instead); LIFO keeps a small set warm.
+    # TCP keepalives let the kernel notice a dead peer (NAT/LB idle drop)
+    # before a pooled connection is handed out mid-burst.
+    options = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE_SECONDS', '1800')),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT_SECONDS', '30')),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+        'pool_use_lifo': True,
+    }
+    if url.startswith('postgresql'):
+        options['connect_args'] = {
+            'keepalives': 1,
+            'keepalives_idle': int(os.getenv('DB_TCP_KEEPALIVES_IDLE', '30')),
+        }
+    return options
+
+
+# echo stays off explicitly: statement logging is a per-query format + write.
+engine = create_engine(DATABASE_URL, echo=False, **_engine_options(DATABASE_URL))
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
+# Objects stay readable after session_scope() commits without a refetch;
+# every scope closes its session right after, so nothing goes stale in use.
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def snapshot(row):
+    """Plain, session-free copy of a model instance's column values.
+
+    Use it to hand rows across threads or past session_scope(): reading a
+    snapshot never lazy-loads or raises DetachedInstanceError.
+    """
+    if row is None:
+        return None
+    return SimpleNamespace(**{c.key: getattr(row, c.key) for c in row.__table__.columns})
+
+
+def upsert(model):
+    """INSERT for ``model`` that supports ``.on_conflict_do_update()``.
+
+    Production is PostgreSQL; the tests run on sqlite, whose dialect offers
+    the same ON CONFLICT API.
+    """
+    dialect = postgresql if engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+# The session of the outermost session_scope() open in this thread/task
+_active_session = ContextVar('_active_session', default=None)
 
 
 @contextmanager
 def session_scope():
-    """Provide a transactional scope around a series of operations."""
+    """Provide a transactional scope around a series of operations.
+
+    Scopes nest: an inner session_scope() joins the outer one's session, so
+    the outermost scope commits once for everything inside it. An exception
+    escaping an inner scope rolls the whole transaction back.
+    """
+    outer = _active_session.get()
+    if outer is not None:
+        try:
+            yield outer
+        except:
+            outer.rollback()
+            raise
+        return
+
     session = Session()
+    token = _active_session.set(session)
     try:
         yield session
         session.commit()
@@ -42,6 +121,7 @@ def session_scope():
         session.rollback()
         raise
     finally:
+        _active_session.reset(token)
         session.close()
 
 
@@ -53,6 +133,11 @@ class User(Base):
     last_verification_attempt = Column(DateTime(timezone=True), nullable=False)
     dob = Column(String(255), nullable=True)  # Fernet-encrypted date of birth
 
+    # Arbiter for the ON CONFLICT (discord_id) upserts; see migration 0007.
+    __table_args__ = (
+        Index('uq_users_discord_id', 'discord_id', unique=True),
+    )
+
     @staticmethod
     def get_current_time():
         return datetime.now(timezone.utc)
@@ -65,13 +150,13 @@ class Server(Base):
     __tablename__ = 'servers'
     id = Column(Integer, primary_key=True)
     server_id = Column(String(30), unique=True, nullable=False)
-    owner_id = Column(String(30), nullable=False)
+    owner_id = Column(String(30), nullable=False, index=True)
     role_id = Column(String(30), nullable=True)
     tier = Column(String(50), nullable=True)
     subscription_status = Column(Boolean, default=False)
     verifications_count = Column(Integer, default=0)
     subscription_start_date = Column(DateTime(timezone=True), nullable=True)
-    stripe_subscription_id = Column(String(255), nullable=True)
+    stripe_subscription_id = Column(String(255), nullable=True, index=True)
     minimum_age = Column(Integer, nullable=False, default=18)
     email = Column(String(255), nullable=True)
     last_renewal_date = Column(DateTime(timezone=True), nullable=True)
@@ -88,6 +173,25 @@ class Server(Base):
     discord_sku_id = Column(String(30), nullable=True)
     discord_entitlement_id = Column(String(30), nullable=True)
     entitlement_ends_at = Column(DateTime(timezone=True), nullable=True)
+    # `created` of the newest Stripe subscription event applied to this row;
+    # subscription_manager ignores older events that arrive late.
+    stripe_event_created = Column(DateTime(timezone=True), nullable=True)
+
+    # subscription_checker's weekly lapse scan: only active servers can lapse,
+    # so on PostgreSQL these are partial indexes over just those rows.
+    __table_args__ = (
+        Index('ix_servers_active_last_renewal_date', 'last_renewal_date',
+              postgresql_where=text('subscription_status')),
+        Index('ix_servers_active_entitlement_ends_at', 'entitlement_ends_at',
+              postgresql_where=text('subscription_status')),
+    )
+
+
+# Prebuilt lookups for the per-command hot paths. Building the select once
+# lets SQLAlchemy's compiled cache hit on every call; callers only bind the
+# parameter: session.execute(SERVER_BY_ID, {'server_id': ...}).scalar()
+SERVER_BY_ID = select(Server).where(Server.server_id == bindparam('server_id')).limit(1)
+USER_BY_DISCORD_ID = select(User).where(User.discord_id == bindparam('discord_id')).limit(1)
 
 
 class CommandUsage(Base):
@@ -98,6 +202,18 @@ class CommandUsage(Base):
     command = Column(String(50), nullable=False)
     timestamp = Column(DateTime(timezone=True), nullable=False)
 
+    # Per-server usage history, newest first (a btree scans either direction)
+    __table_args__ = (Index('ix_command_usage_server_id_timestamp', 'server_id', 'timestamp'),)
+
+
+class ProcessedEvent(Base):
+    """Stripe event ids subscription_manager has already taken on, so a
+    redelivered event is skipped instead of re-applied (e.g. a second token
+    reset). Pruned by subscription_checker."""
+    __tablename__ = 'processed_events'
+    event_id = Column(String(255), primary_key=True)
+    received_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
 
 def init_db():
     """Create all tables on the current engine.
@@ -106,3 +222,8 @@ def init_db():
     schema through Alembic migrations.
     """
     Base.metadata.create_all(engine)
+
+
+# Opt-in convenience for throwaway local databases; never set in deployments.
+if os.getenv('AUTO_CREATE_TABLES') == '1':
+    init_db()
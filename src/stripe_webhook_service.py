@@ -1,21 +1,28 @@
 import os
-import json
 import logging
+import queue
+import threading
 import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from typing import Dict, Any
 
+import orjson
 import pika
+import requests
 import stripe
+from requests.adapters import HTTPAdapter
 from flask import Flask, request
 from dotenv import load_dotenv
-from pika.exceptions import AMQPError
+from pika.exceptions import AMQPError, ChannelClosed, ChannelWrongStateError, NackError, UnroutableError
 from cryptography.fernet import Fernet
 
 try:
-    from .models import User, session_scope
+    from .models import User, session_scope, upsert
+    from .stripe_signature import verify_webhook_event
 except ImportError:
-    from models import User, session_scope
+    from models import User, session_scope, upsert
+    from stripe_signature import verify_webhook_event
 
 # Load environment variables
 load_dotenv()
@@ -35,12 +42,25 @@ app = Flask(__name__)
 stripe.api_key = os.getenv('STRIPE_RESTRICTED_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
+# Stripe's client otherwise opens a requests.Session (and a fresh TLS
+# connection) per thread; share one keep-alive pool across handler threads.
+_stripe_http = requests.Session()
+_stripe_http.mount('https://', HTTPAdapter(pool_maxsize=int(os.getenv('STRIPE_HTTP_POOL_SIZE', '10'))))
+_stripe_client = stripe.RequestsClient(
+    session=_stripe_http,
+    # Fail fast (Stripe's own default is 80s) so a stalled call can't pin a handler thread
+    timeout=float(os.getenv('STRIPE_HTTP_TIMEOUT_SECONDS', '20')),
+)
+stripe.default_http_client = _stripe_client
+# Handlers only read from Stripe, so retrying a dropped connection is safe
+stripe.max_network_retries = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+
 if not STRIPE_WEBHOOK_SECRET:
     raise ValueError("STRIPE_WEBHOOK_SECRET must be set in the environment variables")
 
 # RabbitMQ setup
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
-RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT'))
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT') or 5672)
 RABBITMQ_USERNAME = os.getenv('RABBITMQ_USERNAME')
 RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')
 RABBITMQ_VHOST = os.getenv('RABBITMQ_VHOST')
@@ -76,12 +96,13 @@ if not DOB_KEY:
 
 cipher = Fernet(DOB_KEY)
 
+def encrypt_dob_str(dob_str: str) -> str:
+    """Encrypt an already-formatted YYYY-MM-DD date of birth."""
+    return cipher.encrypt(dob_str.encode('ascii')).decode('ascii')
+
 def encrypt_dob(dob: datetime) -> str:
     """Encrypt the date of birth using Fernet symmetric encryption."""
-    dob_str = dob.strftime('%Y-%m-%d')  # Convert DOB to string
-    dob_bytes = dob_str.encode('utf-8')  # Convert to bytes
-    encrypted_dob = cipher.encrypt(dob_bytes)  # Encrypt the DOB
-    return encrypted_dob.decode('utf-8')  # Return encrypted DOB as string
+    return encrypt_dob_str(dob.strftime('%Y-%m-%d'))
 
 def decrypt_dob(encrypted_dob: str) -> datetime:
     """Decrypt the encrypted DOB back to a datetime object."""
@@ -89,50 +110,190 @@ def decrypt_dob(encrypted_dob: str) -> datetime:
     dob_str = dob_bytes.decode('utf-8')  # Convert bytes back to string
     return datetime.strptime(dob_str, '%Y-%m-%d')  # Convert string to datetime object
 
+def _open_channel(connection):
+    """Open a channel on ``connection`` ready to publish verification results."""
+    channel = connection.channel()
+    channel.queue_declare(queue=RABBITMQ_QUEUE_NAME, durable=True)
+    # Publisher confirms: basic_publish returns only once the broker has
+    # taken the message (raising NackError/UnroutableError otherwise),
+    # so a lost publish is retried instead of silently dropped.
+    channel.confirm_delivery()
+    return channel
+
+
+def _open_publisher():
+    """Open a (connection, channel) pair ready to publish verification results."""
+    connection = pika.BlockingConnection(_rabbitmq_parameters())
+    return connection, _open_channel(connection)
+
+
+def _close_publisher(connection) -> None:
+    try:
+        if connection.is_open:
+            connection.close()
+    except Exception:
+        pass
+
+
+class _PublisherPool:
+    """Long-lived (connection, channel) pairs shared by gunicorn's threads.
+
+    BlockingConnection is not thread-safe, so each publish checks a pair out
+    exclusively. Pairs are opened lazily up to `size` and reused LIFO, so a
+    quiet worker keeps one warm connection rather than `size` idle ones.
+    """
+
+    def __init__(self, size: int):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def channel(self):
+        with self._slots:
+            try:
+                connection, channel = self._idle.get_nowait()
+                try:
+                    # Service heartbeats missed while idle; raises if the
+                    # broker already dropped us, so reconnect before publishing.
+                    connection.process_data_events(time_limit=0)
+                except AMQPError:
+                    logger.info("Pooled RabbitMQ connection lost; reconnecting")
+                    _close_publisher(connection)
+                    connection, channel = _open_publisher()
+                else:
+                    if not channel.is_open:
+                        channel = _open_channel(connection)
+            except queue.Empty:
+                connection, channel = _open_publisher()
+            try:
+                yield channel
+            except (NackError, UnroutableError):
+                # The broker refused this message; the channel is still fine
+                self._idle.put((connection, channel))
+                raise
+            except (ChannelClosed, ChannelWrongStateError):
+                # Only the channel died; a new one on the same connection is
+                # far cheaper than a new TCP + AMQP handshake.
+                self._reopen_channel(connection)
+                raise
+            except BaseException:
+                _close_publisher(connection)
+                raise
+            else:
+                self._idle.put((connection, channel))
+
+    def _reopen_channel(self, connection) -> None:
+        try:
+            if connection.is_open:
+                self._idle.put((connection, _open_channel(connection)))
+                return
+        except AMQPError:
+            pass
+        _close_publisher(connection)
+
+    def close(self) -> None:
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close_publisher(connection)
+
+
+_publisher_pool = _PublisherPool(int(os.getenv('RABBITMQ_MAX_CHANNEL_POOL_SIZE', '16')))
+
+
 def send_to_queue(message: Dict[str, Any], max_retries: int = None) -> None:
+    """Publish ``message`` with confirms; raises once every retry has failed."""
     max_retries = max_retries if max_retries is not None else int(os.getenv('RABBITMQ_PUBLISH_TRIES', '3'))
+    # Always make at least one attempt, so there is an error to re-raise
+    max_retries = max(1, max_retries)
     last_exc = None
     for attempt in range(1, max_retries + 1):
-        connection = None
         try:
-            connection = pika.BlockingConnection(_rabbitmq_parameters())
-            channel = connection.channel()
-            channel.queue_declare(queue=RABBITMQ_QUEUE_NAME, durable=True)
-            channel.basic_publish(
-                exchange='',
-                routing_key=RABBITMQ_QUEUE_NAME,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(delivery_mode=2)  # Make message persistent
-            )
+            with _publisher_pool.channel() as channel:
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=RABBITMQ_QUEUE_NAME,
+                    body=orjson.dumps(message),
+                    properties=pika.BasicProperties(delivery_mode=2),  # Make message persistent
+                    mandatory=True,
+                )
             logger.debug("Message sent to queue successfully")
-            logger.debug(f"Sent message to queue: {message}")
+            logger.debug("Sent message to queue: %s", message)
             return
         except AMQPError as e:
             last_exc = e
+            if attempt == max_retries:
+                break
             logger.warning(f"Failed to send message to queue (attempt {attempt}/{max_retries}); retrying...", exc_info=True)
-            time.sleep(min(10.0, 1.5 * attempt))
-        finally:
-            try:
-                if connection and connection.is_open:
-                    connection.close()
-            except Exception:
-                pass
+            # Exponential backoff (0.1s, 0.2s, 0.4s ... capped at 2s) so a
+            # flapping broker isn't hammered with instant reconnects
+            time.sleep(min(0.1 * 2 ** (attempt - 1), 2.0))
 
     logger.error(f"Failed to send message to queue after {max_retries} attempts", exc_info=last_exc)
+    raise last_exc
+
+
+class _RecentEvents:
+    """Stripe event ids seen in the last `ttl` seconds (per worker process).
+
+    Stripe may deliver the same event more than once; a repeat is acked
+    without re-running the Stripe retrieve, DB write and publish. A failed
+    event is forgotten again so Stripe's redelivery gets processed.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def claim(self, event_id: str) -> bool:
+        """Record `event_id`; False if it was already seen within the TTL."""
+        now = time.monotonic()
+        with self._lock:
+            # Every entry has the same TTL, so the oldest (first) ones expire first
+            while self._seen and next(iter(self._seen.values())) <= now:
+                del self._seen[next(iter(self._seen))]
+            if event_id in self._seen:
+                return False
+            if len(self._seen) >= self.maxsize:
+                del self._seen[next(iter(self._seen))]
+            self._seen[event_id] = now + self.ttl
+            return True
+
+    def forget(self, event_id) -> None:
+        """Un-claim `event_id` (its processing failed and Stripe will redeliver it)."""
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+
+_recent_events = _RecentEvents(
+    maxsize=int(os.getenv('WEBHOOK_DEDUPE_MAX_EVENTS', '10000')),
+    ttl=float(os.getenv('WEBHOOK_DEDUPE_TTL_SECONDS', '600')),
+)
+
+
+HANDLED_EVENT_TYPES = frozenset({
+    'identity.verification_session.verified',
+    'identity.verification_session.canceled',
+})
+
 
 @app.route('/stripe_webhook', methods=['POST'])
 def stripe_webhook() -> tuple:
-    logger.info("Received a webhook from Stripe")
-    payload = request.data.decode('utf-8')
+    # Raw bytes straight into the HMAC check and orjson; never decoded or cached
+    payload = request.get_data(cache=False)
     sig_header = request.headers.get('Stripe-Signature')
 
     # Signature verification is mandatory. ALLOW_UNSIGNED_WEBHOOKS is an explicit
     # opt-in for local testing only and must never be set in production.
     if os.getenv('ALLOW_UNSIGNED_WEBHOOKS', '').lower() in ('1', 'true', 'yes') and request.is_json:
-        event = request.json
+        event = orjson.loads(payload)
     else:
         try:
-            event = stripe.Webhook.construct_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
+            event = verify_webhook_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
         except ValueError as e:
             logger.error(f"Invalid payload: {str(e)}")
             return 'Invalid payload', 400
@@ -140,35 +301,54 @@ def stripe_webhook() -> tuple:
             logger.error(f"Invalid signature: {str(e)}")
             return 'Invalid signature', 400
 
-    logger.info(f"Webhook event type: {event['type']}")
-
+    # One lazily formatted line per delivery; never the payload itself
     etype = event.get('type')
+    logger.info("Received Stripe webhook %s (%d bytes)", etype, len(payload))
+
+    if etype not in HANDLED_EVENT_TYPES:
+        # Ack and drop; don't let ignored events crowd the dedupe window
+        logger.debug("Ignoring unhandled event type %s", etype)
+        return '', 200
+
+    event_id = event.get('id')
+    if event_id and not _recent_events.claim(event_id):
+        logger.info(f"Duplicate delivery of event {event_id}; already handled")
+        return '', 200
+
+    obj = event.get('data', {}).get('object', {})
+    job = None
     if etype == 'identity.verification_session.verified':
-        obj = event.get('data', {}).get('object', {})
         if isinstance(obj, dict):
             session_id = obj.get('id') or event.get('id')
             if session_id:
-                handle_verification_verified(session_id)
-    elif etype == 'identity.verification_session.canceled':
-        obj = event.get('data', {}).get('object', {})
-        if obj:
-            handle_verification_canceled(obj)
-    else:
-        logger.info(f"Unhandled event type: {event['type']}")
+                job = (handle_verification_verified, {**obj, 'id': session_id})
+    elif etype == 'identity.verification_session.canceled' and obj:
+        job = (handle_verification_canceled, obj)
+
+    if job:
+        # Processed on the request thread: Stripe only gets its 2xx once the
+        # DB write and the publish went through, and redelivers otherwise.
+        handler, arg = job
+        try:
+            handler(arg)
+        except Exception:
+            _recent_events.forget(event_id)
+            logger.error(f"Failed to process {etype}; Stripe will redeliver", exc_info=True)
+            return 'Processing failed', 500
 
     return '', 200
 
-def handle_verification_verified(session_id: str) -> None:
-    try:
-        # Retrieve the verification session from Stripe, expanding to include DOB
-        # Note: do not log the session or verified_outputs — they contain PII (DOB, document data)
-        session = stripe.identity.VerificationSession.retrieve(
-            session_id,
-            expand=['verified_outputs.dob']
-        )
-    except Exception as e:
-        logger.error(f"Failed to retrieve verification session: {str(e)}")
-        return
+def handle_verification_verified(session: Dict[str, Any]) -> None:
+    """Record a verified session (the event's data.object) and notify the bot."""
+    session_id = session['id']
+    # Note: do not log the session or verified_outputs — they contain PII (DOB, document data)
+    # Webhook payloads never include verified_outputs.dob (Stripe only returns
+    # it to an expanded fetch), so always retrieve the session. A failed
+    # retrieve propagates so the endpoint answers 500.
+    session = stripe.identity.VerificationSession.retrieve(
+        session_id,
+        expand=['verified_outputs.dob']
+    )
 
     # Extract metadata from the session (guild_id, user_id, role_id)
     metadata = session.get('metadata', {})
@@ -181,31 +361,31 @@ def handle_verification_verified(session_id: str) -> None:
         return
 
     # Extract and format the date of birth (DOB)
-    dob = session.verified_outputs.get('dob', {})
-    birthdate = f"{dob.get('year', '')}-{dob.get('month', ''):02d}-{dob.get('day', ''):02d}"
+    dob = (session.get('verified_outputs') or {}).get('dob') or {}
+    try:
+        birthdate = f"{int(dob['year']):04d}-{int(dob['month']):02d}-{int(dob['day']):02d}"
+    except (KeyError, TypeError, ValueError):
+        # Retrying won't produce a DOB; don't mark the user verified without one
+        logger.error(f"Verification session {session_id} for user {user_id} has no complete DOB")
+        return
 
     # Encrypt the DOB before storing it in the database
-    encrypted_dob = encrypt_dob(datetime.strptime(birthdate, "%Y-%m-%d"))
-    verification_status = True
-
-    # Check if the user already exists in the database, then update or create a new user
+    encrypted_dob = encrypt_dob_str(birthdate)
+    now = datetime.now(timezone.utc)
+
+    # One atomic upsert: no SELECT round-trip, and concurrent webhooks for
+    # the same user can't race each other into an IntegrityError
+    fields = {
+        'verification_status': True,
+        'dob': encrypted_dob,  # Store the encrypted DOB
+        'last_verification_attempt': now,
+    }
+    stmt = upsert(User).values(discord_id=user_id, **fields).on_conflict_do_update(
+        index_elements=[User.discord_id], set_=fields
+    )
     with session_scope() as db_session:
-        user = db_session.query(User).filter_by(discord_id=user_id).first()
-        if user:
-            user.verification_status = verification_status
-            user.dob = encrypted_dob  # Store the encrypted DOB
-            user.last_verification_attempt = datetime.now(timezone.utc)
-            logger.info(f"User {user_id} marked as verified with encrypted DOB")
-        else:
-            # Add new user if not found
-            new_user = User(
-                discord_id=user_id,
-                verification_status=verification_status,
-                dob=encrypted_dob,  # Store the encrypted DOB
-                last_verification_attempt=datetime.now(timezone.utc)
-            )
-            db_session.add(new_user)
-            logger.info(f"New user {user_id} added with encrypted DOB")
+        db_session.execute(stmt)
+    logger.info(f"User {user_id} marked as verified with encrypted DOB")
 
     # Send the verification success message to the queue for role assignment in Discord
     message = {
@@ -227,24 +407,16 @@ def handle_verification_canceled(session: Dict[str, Any]) -> None:
         logger.error(f"Missing user_id in metadata: {metadata}")
         return
 
-    verification_status = False
-
-    # Check if user exists and update, otherwise create a new user
+    fields = {
+        'verification_status': False,
+        'last_verification_attempt': datetime.now(timezone.utc),
+    }
+    stmt = upsert(User).values(discord_id=user_id, **fields).on_conflict_do_update(
+        index_elements=[User.discord_id], set_=fields
+    )
     with session_scope() as db_session:
-        user = db_session.query(User).filter_by(discord_id=user_id).first()
-        if user:
-            user.verification_status = verification_status
-            user.last_verification_attempt = datetime.now(timezone.utc)
-            logger.info(f"User {user_id} verification attempt canceled")
-        else:
-            # Add new user if not found
-            new_user = User(
-                discord_id=user_id,
-                verification_status=verification_status,
-                last_verification_attempt=datetime.now(timezone.utc)
-            )
-            db_session.add(new_user)
-            logger.info(f"New user {user_id} added with verification attempt canceled")
+        db_session.execute(stmt)
+    logger.info(f"User {user_id} verification attempt canceled")
 
     message = {
         'type': 'verification_canceled',
@@ -1,13 +1,14 @@
 import os
 import logging
 from datetime import datetime, timezone, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
 from dotenv import load_dotenv
+from sqlalchemy import and_, delete, or_, update
 
 try:
-    from .models import Server, session_scope
+    from .models import ProcessedEvent, Server, session_scope
 except ImportError:
-    from models import Server, session_scope
+    from models import ProcessedEvent, Server, session_scope
 
 # -------------------------------------------------------------------
 #  Load environment variables and set up logging
@@ -42,38 +43,69 @@ def check_subscriptions():
     grace_days = int(os.getenv('ENTITLEMENT_GRACE_DAYS', '3'))
     entitlement_cutoff = now - timedelta(days=grace_days)
 
+    # One set-based UPDATE for both rails; RETURNING gives the rows for the
+    # log without hydrating ORM objects or issuing an UPDATE per server.
+    lapse = (
+        update(Server)
+        .where(
+            Server.subscription_status == True,
+            or_(
+                and_(
+                    Server.payment_provider != 'discord',
+                    Server.last_renewal_date <= one_month_ago,
+                ),
+                and_(
+                    Server.payment_provider == 'discord',
+                    Server.entitlement_ends_at != None,
+                    Server.entitlement_ends_at <= entitlement_cutoff,
+                ),
+            ),
+        )
+        .values(subscription_status=False)
+        .returning(Server.server_id, Server.payment_provider)
+        .execution_options(synchronize_session=False)
+    )
+
     try:
         with session_scope() as db_session_v:
-            stripe_lapsed = db_session_v.query(Server).filter(
-                Server.subscription_status == True,
-                Server.payment_provider != 'discord',
-                Server.last_renewal_date <= one_month_ago
-            ).all()
-
-            discord_lapsed = db_session_v.query(Server).filter(
-                Server.subscription_status == True,
-                Server.payment_provider == 'discord',
-                Server.entitlement_ends_at != None,
-                Server.entitlement_ends_at <= entitlement_cutoff
-            ).all()
-
-            for server in stripe_lapsed + discord_lapsed:
+            for server_id, provider in db_session_v.execute(lapse):
                 logging.info(
-                    f"[VERIFY_DB] Marking server {server.server_id} as inactive "
-                    f"(lapsed, provider={server.payment_provider})."
+                    f"[VERIFY_DB] Marking server {server_id} as inactive "
+                    f"(lapsed, provider={provider})."
                 )
-                server.subscription_status = False
 
     except Exception as e:
         logging.error(f"[VERIFY_DB] Error checking servers: {e}")
 
     logging.info("[CHECKER] Weekly check completed.")
 
+# -------------------------------------------------------------------
+#  Nightly processed_events prune
+# -------------------------------------------------------------------
+def prune_processed_events():
+    """Drop Stripe event ids older than PROCESSED_EVENT_RETENTION_DAYS (30).
+
+    Stripe stops redelivering an event after three days, so ids past that
+    window can never be needed for deduplication again.
+    """
+    days = int(os.getenv('PROCESSED_EVENT_RETENTION_DAYS', '30'))
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    try:
+        with session_scope() as db_session_v:
+            pruned = db_session_v.execute(
+                delete(ProcessedEvent).where(ProcessedEvent.received_at < cutoff)
+            ).rowcount
+        logging.info(f"[CHECKER] Pruned {pruned} processed Stripe event ids.")
+    except Exception as e:
+        logging.error(f"[VERIFY_DB] Error pruning processed events: {e}")
+
 # -------------------------------------------------------------------
 #  Main (Schedule the Weekly Check)
 # -------------------------------------------------------------------
 if __name__ == '__main__':
-    scheduler = BackgroundScheduler()
+    # BlockingScheduler runs jobs from start() and sleeps on a condition
+    # between them, so the main thread neither spins nor needs a wait loop.
+    scheduler = BlockingScheduler()
     # Runs every Sunday at 23:59
     scheduler.add_job(
         check_subscriptions,
@@ -82,12 +114,11 @@ if __name__ == '__main__':
         hour=23,
         minute=59
     )
+    # Runs every day at 03:30
+    scheduler.add_job(prune_processed_events, 'cron', hour=3, minute=30)
 
-    scheduler.start()
     logging.info("Subscription checker started. Press Ctrl+C to exit.")
-
     try:
-        scheduler._event.wait()
+        scheduler.start()
     except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
         logging.info("Subscription checker stopped.")
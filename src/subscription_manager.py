@@ -1,27 +1,63 @@
 import os
+import orjson
+import requests
 import stripe
+from requests.adapters import HTTPAdapter
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 import logging
 from datetime import datetime, timezone
+from types import MappingProxyType
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import load_only
 
 try:
-    from .models import Server, session_scope
-    from .billing import apply_tier
+    from .models import ProcessedEvent, Server, session_scope, upsert
+    from .billing import TIER_TOKENS, apply_tier
+    from .stripe_signature import verify_webhook_event
 except ImportError:
-    from models import Server, session_scope
-    from billing import apply_tier
+    from models import ProcessedEvent, Server, session_scope, upsert
+    from billing import TIER_TOKENS, apply_tier
+    from stripe_signature import verify_webhook_event
 
 # Load environment variables
 load_dotenv()
 
+
+class _OrjsonProvider(JSONProvider):
+    """Route Flask's JSON (jsonify, request.get_json) through orjson, the same
+    parser the verified webhook payloads already go through."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = _OrjsonProvider(app)
 
 # Stripe configuration
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 endpoint_secret = os.getenv('STRIPE_PAYMENT_WEBHOOK_SECRET')
 
+# Stripe's client otherwise opens a requests.Session (and a fresh TLS
+# connection) per thread; share one keep-alive pool across handler threads.
+_stripe_http = requests.Session()
+_stripe_http.mount('https://', HTTPAdapter(pool_maxsize=int(os.getenv('STRIPE_HTTP_POOL_SIZE', '10'))))
+_stripe_client = stripe.RequestsClient(
+    session=_stripe_http,
+    # Fail fast (Stripe's own default is 80s) so a stalled call can't pin a handler thread
+    timeout=float(os.getenv('STRIPE_HTTP_TIMEOUT_SECONDS', '20')),
+)
+stripe.default_http_client = _stripe_client
+# Handlers only read from Stripe, so retrying a dropped connection is safe
+stripe.max_network_retries = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+
 # Logging setup
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(
@@ -30,34 +66,50 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# Product IDs for Routing
-PRODUCT_ID_TO_TIER = {
-    'prod_QrCgveExowX4SZ': {'tier': 'tier_0', 'tokens': 0},
-    'prod_Ra9LidflO2dgt0': {'tier': 'tier_1', 'tokens': 10},
-    'prod_Ra9LxBfXnAUz8o': {'tier': 'tier_2', 'tokens': 25},
-    'prod_QtuWzcaMquctfT': {'tier': 'tier_3', 'tokens': 50},
-    'prod_QtuXjrcE0cIlLG': {'tier': 'tier_4', 'tokens': 75},
-    'prod_QtuYXFfzpKS29k': {'tier': 'tier_5', 'tokens': 100},
-    'prod_QtuYlkTvZ0181h': {'tier': 'tier_6', 'tokens': 150},
-}
-
-# Mapping of product IDs to one-time purchase token amounts
-PRODUCT_ID_TO_EXTRA_TOKENS = {
-    'prod_QXmfTZh1Gn0P8L': 10,
-    'prod_QXmgiGMLNpSNZt': 25,
-    'prod_QXmiBjX9MWZtPw': 50,
-    'prod_QXmiFdyIb5mN17': 100,
-}
+# Product IDs for Routing. Token amounts come from billing.TIER_TOKENS so
+# the Stripe and Discord rails can't drift; both maps are read-only.
+PRODUCT_ID_TO_TIER = MappingProxyType({
+    product_id: MappingProxyType({'tier': tier, 'tokens': TIER_TOKENS[tier]})
+    for product_id, tier in {
+        'prod_QrCgveExowX4SZ': 'tier_0',
+        'prod_Ra9LidflO2dgt0': 'tier_1',
+        'prod_Ra9LxBfXnAUz8o': 'tier_2',
+        'prod_QtuWzcaMquctfT': 'tier_3',
+        'prod_QtuXjrcE0cIlLG': 'tier_4',
+        'prod_QtuYXFfzpKS29k': 'tier_5',
+        'prod_QtuYlkTvZ0181h': 'tier_6',
+    }.items()
+})
+
+# A fixed pool (not a thread per event) so a Stripe retry storm can't spawn
+# unbounded threads and DB sessions. Past WEBHOOK_MAX_PENDING queued events
+# the endpoint answers 503 and Stripe redelivers later.
+_event_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('WEBHOOK_HANDLER_THREADS', '8')),
+    thread_name_prefix='subscription-webhook',
+)
+_pending_events = threading.BoundedSemaphore(int(os.getenv('WEBHOOK_MAX_PENDING', '100')))
+
+
+# Event types process_event acts on
+HANDLED_EVENT_TYPES = frozenset({
+    'checkout.session.completed',
+    'customer.subscription.created',
+    'customer.subscription.updated',
+    'customer.subscription.deleted',
+})
+
 
 @app.route('/stripe-webhook', methods=['POST'])
 def stripe_webhook():
-    payload = request.get_data(as_text=True)
+    # Raw bytes straight into the HMAC check and orjson; never decoded or cached
+    payload = request.get_data(cache=False)
     sig_header = request.headers.get('Stripe-Signature')
 
     try:
         # Do not log the raw payload — it contains customer emails and billing details
-        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
-        logging.info(f"Received Stripe webhook event: {event['type']}")
+        event = verify_webhook_event(payload, sig_header, endpoint_secret)
+        logging.info("Received Stripe webhook event %s (%d bytes)", event['type'], len(payload))
     except ValueError as e:
         # Invalid payload
         logging.error(f"Invalid payload: {e}")
@@ -71,146 +123,167 @@ def stripe_webhook():
         logging.error(f"Error verifying webhook signature: {e}")
         return jsonify({'error': 'Webhook verification failed'}), 400
 
+    if event.get('type') not in HANDLED_EVENT_TYPES:
+        # Most of what Stripe sends (charges, invoices, payment intents) is
+        # ignored; ack it without queueing a worker
+        return jsonify({'status': 'ignored'}), 200
+
     # Process the event asynchronously
-    thread = threading.Thread(target=process_event, args=(event,))
-    thread.start()
+    if not _pending_events.acquire(blocking=False):
+        logging.warning(f"Webhook backlog full; asking Stripe to redeliver {event['type']}")
+        return jsonify({'error': 'Busy'}), 503
+    future = _event_executor.submit(process_event, event)
+    future.add_done_callback(lambda _: _pending_events.release())
 
     return jsonify({'status': 'success'}), 200
 
+def _claim_event(event_id) -> bool:
+    """Record event_id as processed; False if some worker already had it."""
+    stmt = upsert(ProcessedEvent).values(event_id=event_id).on_conflict_do_nothing()
+    with session_scope() as db_session:
+        return db_session.execute(stmt).rowcount == 1
+
+
+def resolve_product_id(obj):
+    """Product of the first item embedded in a checkout session (expanded
+    line_items) or subscription (items) object; None if none is embedded."""
+    items = (obj.get('line_items') or obj.get('items') or {}).get('data') or []
+    return items[0]['price']['product'] if items else None
+
+
+def _not_older_than(event_created):
+    """Row condition: no subscription event newer than event_created has
+    been applied yet. Stripe does not guarantee delivery order, so a late
+    retry of an old event must not overwrite newer state."""
+    return or_(Server.stripe_event_created == None, Server.stripe_event_created <= event_created)
+
+
 def process_event(event):
     """
     Handles Stripe webhook events for the VerifyMe verification service.
+
+    The event-id claim and the handler's write share one transaction (one
+    commit per event); a handler that fails also releases the claim.
     """
     try:
         event_type = event['type']
-
-        # 1) Checkout Session Completed
-        if event_type == 'checkout.session.completed':
-            session_obj = event['data']['object']
-            subscription_id = session_obj.get('subscription')
-            if subscription_id:
-                subscription = stripe.Subscription.retrieve(subscription_id)
-                product_id = subscription['items']['data'][0]['price']['product']
-
-                if product_id in PRODUCT_ID_TO_TIER:
-                    handle_verification_checkout_session(session_obj)
-
-        elif event_type == 'customer.subscription.created':
-            subscription = event['data']['object']
-            product_id = subscription['items']['data'][0]['price']['product']
-            subscription_id = subscription['id']
-            status = subscription['status']
-            metadata = subscription.get('metadata', {})
-            current_period_start = subscription.get('current_period_start')
-
-            # Convert Unix timestamp to datetime
-            current_period_start_dt = None
-            if current_period_start:
-                current_period_start_dt = datetime.fromtimestamp(current_period_start, tz=timezone.utc)
-
-            if product_id in PRODUCT_ID_TO_TIER:
-                handle_verification_subscription_created(subscription_id, status, metadata, current_period_start_dt)
-
-        elif event_type == 'customer.subscription.updated':
-            subscription = event['data']['object']
-            product_id = subscription['items']['data'][0]['price']['product']
-            subscription_id = subscription['id']
-            status = subscription['status']
-            metadata = subscription.get('metadata', {})
-            current_period_start = subscription.get('current_period_start')
-            # Convert Unix timestamp to datetime
-            current_period_start_dt = None
-            if current_period_start:
-                current_period_start_dt = datetime.fromtimestamp(current_period_start, tz=timezone.utc)
-
-            if product_id in PRODUCT_ID_TO_TIER:
-                handle_verification_subscription_update(subscription_id, status, metadata, current_period_start_dt)
-
-        elif event_type == 'customer.subscription.deleted':
-            subscription = event['data']['object']
-            product_id = subscription['items']['data'][0]['price']['product']
-            subscription_id = subscription['id']
-            metadata = subscription.get('metadata', {})
-
-            if product_id in PRODUCT_ID_TO_TIER:
-                handle_verification_subscription_deleted(subscription_id, metadata)
+        obj = event['data']['object']
+        product_id = resolve_product_id(obj)
+        if event_type == 'checkout.session.completed' and product_id is None and obj.get('subscription'):
+            # Line items not expanded on this endpoint: ask Stripe before a
+            # DB connection is checked out, not while holding one
+            product_id = resolve_product_id(stripe.Subscription.retrieve(obj['subscription']))
+
+        with session_scope():
+            if event.get('id') and not _claim_event(event['id']):
+                logging.info(f"Skipping already-processed Stripe event {event['id']}")
+                return
+            _apply_event(event_type, obj, product_id, event.get('created'))
 
     except Exception as e:
         logging.error(f"Error processing event: {e}")
 
 
+def _apply_event(event_type, obj, product_id, created):
+    """Route one claimed event to its handler; runs inside process_event's
+    transaction."""
+    if event_type not in HANDLED_EVENT_TYPES or product_id not in PRODUCT_ID_TO_TIER:
+        return
+
+    # 1) Checkout Session Completed
+    if event_type == 'checkout.session.completed':
+        if obj.get('subscription'):
+            handle_verification_checkout_session(obj, product_id)
+        return
+
+    # 2) customer.subscription.*: everything needed is in the payload
+    event_created = datetime.fromtimestamp(created, tz=timezone.utc) if created else None
+    subscription_id = obj['id']
+    metadata = obj.get('metadata', {})
+
+    if event_type == 'customer.subscription.deleted':
+        handle_verification_subscription_deleted(subscription_id, metadata, event_created=event_created)
+        return
+
+    status = obj['status']
+    current_period_start = obj.get('current_period_start')
+    # Convert Unix timestamp to datetime
+    current_period_start_dt = None
+    if current_period_start:
+        current_period_start_dt = datetime.fromtimestamp(current_period_start, tz=timezone.utc)
+
+    handler = (
+        handle_verification_subscription_created
+        if event_type == 'customer.subscription.created'
+        else handle_verification_subscription_update
+    )
+    handler(subscription_id, status, metadata, current_period_start_dt, product_id,
+            event_created=event_created)
+
+
 # -------------------------------------------------------
 #    HANDLERS FOR VERIFICATION SERVICE (SERVER MODEL)
 # -------------------------------------------------------
-def handle_verification_checkout_session(session):
+def handle_verification_checkout_session(session, product_id=None):
     """
     Called when checkout.session.completed fires for a new subscription
-    to the verification service.
+    to the verification service. process_event passes the product it already
+    resolved; otherwise it is looked up from the session's line items.
     """
     logging.info("Handling checkout.session.completed event for Verification Service")
     customer_email = session['customer_details'].get('email')
     custom_fields = session.get('custom_fields', [])
 
-    guild_id = next(
-        (
-            field['text']['value']
-            for field in custom_fields
-            if field['key'] in ['discordserverid', 'discordserveridnotyourservername', 'discordserveridnotservername']
-        ),
-        None
-    )
-    discord_id = next(
-        (
-            field['text']['value']
-            for field in custom_fields
-            if field['key'] == 'discorduseridnotyourusername'
-        ),
-        None
+    # One pass over the checkout form; non-text fields carry no value
+    fields = {f['key']: (f.get('text') or {}).get('value') for f in custom_fields}
+    guild_id = (
+        fields.get('discordserverid')
+        or fields.get('discordserveridnotyourservername')
+        or fields.get('discordserveridnotservername')
     )
+    discord_id = fields.get('discorduseridnotyourusername')
     subscription_id = session.get('subscription')
 
-    line_items = stripe.checkout.Session.list_line_items(session['id'])
-    product_id = line_items['data'][0]['price']['product']
+    if product_id is None:
+        # Only present when the event's session was expanded; else ask Stripe
+        line_items = session.get('line_items') or stripe.checkout.Session.list_line_items(session['id'])
+        product_id = line_items['data'][0]['price']['product']
     tier_info = PRODUCT_ID_TO_TIER.get(product_id)
 
     if not guild_id or not discord_id or not tier_info:
         logging.error("Missing guild_id, discord_id, or tier info.")
         return
 
+    now = datetime.now(timezone.utc)
+    fields = {
+        'tier': tier_info['tier'],
+        'subscription_status': True,
+        'subscription_start_date': now,
+        'stripe_subscription_id': subscription_id,
+        'role_id': session['metadata'].get('role_id'),
+        'email': customer_email,
+        'payment_provider': 'stripe',
+        # Initialize last_renewal_date to the same as subscription_start_date
+        'last_renewal_date': now,
+    }
+    # Insert the server, or top up an existing one, in one atomic statement
+    stmt = upsert(Server).values(
+        server_id=guild_id,
+        owner_id=discord_id,
+        verifications_count=tier_info['tokens'],
+        **fields,
+    ).on_conflict_do_update(
+        index_elements=[Server.server_id],
+        set_={
+            **fields,
+            'verifications_count': func.coalesce(Server.verifications_count, 0)
+            + tier_info['tokens'],
+        },
+    )
+
     try:
-        extra_tokens = PRODUCT_ID_TO_EXTRA_TOKENS.get(product_id, 0)
         with session_scope() as db_session:
-            server = db_session.query(Server).filter_by(server_id=guild_id).first()
-
-            if server:
-                server.tier = tier_info['tier']
-                server.subscription_status = True
-                server.verifications_count += tier_info['tokens']
-                server.subscription_start_date = datetime.now(timezone.utc)
-                server.stripe_subscription_id = subscription_id
-                server.role_id = session['metadata'].get('role_id')
-                server.email = customer_email
-                server.payment_provider = 'stripe'
-                # Initialize last_renewal_date to the same as subscription_start_date
-                server.last_renewal_date = server.subscription_start_date
-            else:
-                new_server = Server(
-                    server_id=guild_id,
-                    owner_id=discord_id,
-                    tier=tier_info['tier'],
-                    subscription_status=True,
-                    verifications_count=tier_info['tokens'],
-                    subscription_start_date=datetime.now(timezone.utc),
-                    stripe_subscription_id=subscription_id,
-                    role_id=session['metadata'].get('role_id'),
-                    email=customer_email,
-                    last_renewal_date=datetime.now(timezone.utc)
-                )
-                db_session.add(new_server)
-
-            # If product was a one-time token purchase
-            if extra_tokens and server:
-                server.verifications_count += extra_tokens
+            db_session.execute(stmt)
 
         logging.info(f"Updated verification subscription for guild {guild_id}.")
 
@@ -218,23 +291,27 @@ def handle_verification_checkout_session(session):
         logging.error(f"Error updating verification database: {e}")
 
 
-def handle_verification_subscription_created(subscription_id, status, metadata, current_period_start_dt):
+def handle_verification_subscription_created(subscription_id, status, metadata, current_period_start_dt,
+                                             product_id=None, event_created=None):
     """
     Called when customer.subscription.created is triggered.
     Sets subscription active, sets tier, and initializes last_renewal_date.
+    product_id comes from the event payload when available; otherwise the
+    subscription is retrieved from Stripe. An existing row that already saw
+    a newer subscription event (event_created) is left alone.
     """
     guild_id = metadata.get('guild_id')
     if not guild_id:
         logging.warning("No guild_id in metadata for verification subscription creation.")
         return
 
-    product_id = None
-    try:
-        subscription = stripe.Subscription.retrieve(subscription_id)
-        product_id = subscription['items']['data'][0]['price']['product']
-    except Exception as e:
-        logging.error(f"Unable to retrieve subscription {subscription_id}. Error: {e}")
-        return
+    if product_id is None:
+        try:
+            subscription = stripe.Subscription.retrieve(subscription_id)
+            product_id = resolve_product_id(subscription)
+        except Exception as e:
+            logging.error(f"Unable to retrieve subscription {subscription_id}. Error: {e}")
+            return
 
     tier_info = PRODUCT_ID_TO_TIER.get(product_id)
     if not tier_info:
@@ -243,40 +320,53 @@ def handle_verification_subscription_created(subscription_id, status, metadata,
 
     logging.info(f"Creating Verification subscription for guild {guild_id} with product {product_id}.")
 
+    now = datetime.now(timezone.utc)
+    fields = {
+        'subscription_status': True,
+        'tier': tier_info['tier'],
+        'stripe_subscription_id': subscription_id,
+        'payment_provider': 'stripe',
+    }
+    on_conflict = {
+        **fields,
+        # We preserve subscription_start_date for analytics; if empty, initialize it now
+        'subscription_start_date': func.coalesce(
+            Server.subscription_start_date, current_period_start_dt or now
+        ),
+    }
+    if current_period_start_dt:
+        on_conflict['last_renewal_date'] = current_period_start_dt
+    if event_created:
+        fields['stripe_event_created'] = on_conflict['stripe_event_created'] = event_created
+    stmt = upsert(Server).values(
+        server_id=guild_id,
+        owner_id=metadata.get('discorduseridnotyourusername', 'UNKNOWN'),
+        verifications_count=tier_info['tokens'],
+        subscription_start_date=current_period_start_dt or now,
+        email=metadata.get('email'),
+        last_renewal_date=current_period_start_dt or now,
+        **fields,
+    ).on_conflict_do_update(
+        index_elements=[Server.server_id],
+        set_=on_conflict,
+        where=_not_older_than(event_created) if event_created else None,
+    )
+
     try:
         with session_scope() as db_session:
-            server = db_session.query(Server).filter_by(server_id=guild_id).first()
-            if server:
-                server.subscription_status = True
-                server.tier = tier_info['tier']
-                if current_period_start_dt:
-                    server.last_renewal_date = current_period_start_dt
-                # We preserve subscription_start_date for analytics; if empty, initialize it now
-                if not server.subscription_start_date:
-                    server.subscription_start_date = current_period_start_dt or datetime.now(timezone.utc)
-                server.stripe_subscription_id = subscription_id
-                server.payment_provider = 'stripe'
-            else:
-                new_server = Server(
-                    server_id=guild_id,
-                    owner_id=metadata.get('discorduseridnotyourusername', 'UNKNOWN'),
-                    tier=tier_info['tier'],
-                    subscription_status=True,
-                    verifications_count=tier_info['tokens'],
-                    subscription_start_date=current_period_start_dt or datetime.now(timezone.utc),
-                    stripe_subscription_id=subscription_id,
-                    email=metadata.get('email'),
-                    last_renewal_date=current_period_start_dt or datetime.now(timezone.utc)
-                )
-                db_session.add(new_server)
+            db_session.execute(stmt)
 
     except Exception as e:
         logging.error(f"Error creating verification subscription in DB: {e}")
 
 
-def handle_verification_subscription_update(subscription_id, status, metadata, current_period_start_dt):
+def handle_verification_subscription_update(subscription_id, status, metadata, current_period_start_dt,
+                                            product_id=None, event_created=None):
     """
     Called when a subscription is updated (e.g., tier change, renewal).
+    product_id comes from the event payload when available; otherwise the
+    subscription is retrieved from Stripe. Skipped when the row already saw
+    a newer subscription event than event_created.
     """
     guild_id = metadata.get('guild_id')
     logging.info(f"Updating verification subscription {subscription_id} for guild {guild_id} with status {status}")
@@ -286,13 +376,31 @@ def handle_verification_subscription_update(subscription_id, status, metadata, c
         return
 
     try:
-        subscription = stripe.Subscription.retrieve(subscription_id)
-        product_id = subscription['items']['data'][0]['price']['product']
+        if product_id is None:
+            product_id = resolve_product_id(stripe.Subscription.retrieve(subscription_id))
         tier_info = PRODUCT_ID_TO_TIER.get(product_id)
 
+        query = (
+            select(Server)
+            # Only what apply_tier reads; the rest of the row is just overwritten
+            .options(load_only(
+                Server.server_id, Server.subscription_status, Server.tier,
+                Server.last_renewal_date,
+            ))
+            .where(Server.server_id == guild_id)
+            # Row lock until commit: a concurrent newer event waits for this
+            # write, and if it committed first PostgreSQL rechecks the
+            # staleness guard against that version and returns no row
+            .with_for_update()
+        )
+        if event_created:
+            query = query.where(_not_older_than(event_created))
+
         with session_scope() as db_session:
-            server = db_session.query(Server).filter_by(server_id=guild_id).first()
-            if server:
+            server = db_session.execute(query).scalar()
+            if not server:
+                logging.info(f"No current row for guild {guild_id}; skipping update from {subscription_id}.")
+            else:
                 # Shared renewal/refill semantics (billing.apply_tier): on
                 # each renewal the allowance resets to the tier amount.
                 apply_tier(
@@ -305,6 +413,8 @@ def handle_verification_subscription_update(subscription_id, status, metadata, c
                 # Keep subscription_start_date for analytics, no immediate changes
                 server.stripe_subscription_id = subscription_id
                 server.payment_provider = 'stripe'
+                if event_created:
+                    server.stripe_event_created = event_created
 
                 logging.info(f"Updated verification guild {guild_id}, active: {server.subscription_status}, tier: {server.tier}")
 
@@ -312,23 +422,33 @@ def handle_verification_subscription_update(subscription_id, status, metadata, c
         logging.error(f"Error updating verification database for subscription update: {e}")
 
 
-def handle_verification_subscription_deleted(subscription_id, metadata):
+def handle_verification_subscription_deleted(subscription_id, metadata, event_created=None):
     """
     Called when Stripe deletes/cancels a subscription immediately (or at period end).
     We mark subscription_status as inactive, but keep last_renewal_date for history.
     """
     logging.info(f"Deleting verification subscription {subscription_id}.")
 
+    # One UPDATE; no need to load the row just to flip a flag
+    stmt = update(Server).where(Server.stripe_subscription_id == subscription_id)
+    values = {'subscription_status': False}
+    if event_created:
+        stmt = stmt.where(_not_older_than(event_created))
+        values['stripe_event_created'] = event_created
+    stmt = (
+        stmt.values(**values)
+        .returning(Server.server_id)
+        .execution_options(synchronize_session=False)
+    )
     try:
         with session_scope() as db_session:
-            server = db_session.query(Server).filter_by(stripe_subscription_id=subscription_id).first()
-            if server:
-                server.subscription_status = False
-                # We do NOT reset last_renewal_date, we keep it for historical reference
-                logging.info(f"Verification subscription marked inactive for subscription_id={subscription_id}.")
-            else:
-                # If no server is found, log a warning or error
-                logging.warning(f"No server found matching stripe_subscription_id={subscription_id}.")
+            deactivated = db_session.execute(stmt).all()
+        if deactivated:
+            # We do NOT reset last_renewal_date, we keep it for historical reference
+            logging.info(f"Verification subscription marked inactive for subscription_id={subscription_id}.")
+        else:
+            # If no server is found, log a warning or error
+            logging.warning(f"No server found matching stripe_subscription_id={subscription_id}.")
     except Exception as e:
         logging.error(f"Error handling verification subscription deletion: {e}")
 
@@ -21,6 +21,8 @@ runs first.
 import os
 import sys
 
+import pytest
+
 os.environ["DATABASE_URL_VERIFICATION"] = "sqlite:///:memory:"
 
 # Also keep RabbitMQ pointed somewhere inert. No current test connects to a
@@ -35,9 +37,8 @@ from cryptography.fernet import Fernet  # noqa: E402
 os.environ["DOB_KEY"] = Fernet.generate_key().decode()
 
 # The services hard-require these at import (bot.py's required_env_vars
-# check, stripe_webhook_service's STRIPE_WEBHOOK_SECRET guard and
-# int(RABBITMQ_PORT) cast); give inert values so the test suite runs on
-# machines/CI without a populated .env.
+# check, stripe_webhook_service's STRIPE_WEBHOOK_SECRET guard); give inert
+# values so the test suite runs on machines/CI without a populated .env.
 os.environ.setdefault("DISCORD_BOT_TOKEN", "test-token")
 os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_dummy")
 os.environ.setdefault("STRIPE_RESTRICTED_SECRET_KEY", "rk_test_dummy")
@@ -97,3 +98,32 @@ def pytest_runtest_setup(item):
                     f"non-sqlite database ({url}). Refusing to run '{item.nodeid}' "
                     f"to prevent touching a real database."
                 )
+
+
+@pytest.fixture(scope="function")
+def clean_db():
+    """Session on an empty test database; every table is emptied again
+    after the test."""
+    session = models.Session()
+
+    def empty_tables():
+        for table in reversed(models.Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+
+    empty_tables()
+    yield session
+    session.rollback()
+    empty_tables()
+    session.close()
+
+
+@pytest.fixture(autouse=True)
+def _clear_bot_server_cache():
+    """The bot caches Server snapshots in-process; don't let one test's rows
+    answer for the next test's database state."""
+    yield
+    for modname in ("src.bot", "bot"):
+        mod = sys.modules.get(modname)
+        if mod is not None:
+            mod._server_config_cache.clear()
@@ -18,7 +18,7 @@ async def test_verify_command_missing_server_config():
     mock_interaction.followup.send = AsyncMock()
 
     mock_session = MagicMock()
-    mock_session.query.return_value.filter_by.return_value.first.return_value = None
+    mock_session.execute.return_value.first.return_value = None
 
     with patch("src.bot.session_scope") as mock_session_scope:
         mock_session_scope.return_value.__enter__.return_value = mock_session
@@ -29,6 +29,43 @@ async def test_verify_command_missing_server_config():
     mock_interaction.followup.send.assert_awaited()
 
 
+@pytest.mark.asyncio
+async def test_verify_loads_server_and_user_in_one_query(clean_db):
+    """The server and user rows come back from a single joined SELECT; an
+    already-verified user on a tier_0 server gets the role re-assigned."""
+    from datetime import datetime, timezone
+    import models
+
+    clean_db.add(models.Server(server_id="123", owner_id="1", role_id="999",
+                               tier="tier_0", subscription_status=True))
+    clean_db.add(models.User(discord_id="456", verification_status=True,
+                             last_verification_attempt=datetime.now(timezone.utc)))
+    clean_db.commit()
+
+    mock_interaction = MagicMock()
+    mock_interaction.guild.id = 123
+    mock_interaction.user.id = 456
+    mock_interaction.locale = "en-US"
+    mock_interaction.response.defer = AsyncMock()
+    mock_interaction.followup.send = AsyncMock()
+
+    statements = []
+    from sqlalchemy import event
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(models.engine, "before_cursor_execute", _count)
+    try:
+        with patch("src.bot.assign_role", new_callable=AsyncMock) as mock_assign:
+            await bot_module.verify(mock_interaction)
+    finally:
+        event.remove(models.engine, "before_cursor_execute", _count)
+
+    mock_assign.assert_awaited_once()
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+
+
 @pytest.mark.asyncio
 async def test_verify_command_dm_rejected():
     """verify() must refuse to run outside a guild instead of raising on
@@ -83,3 +120,378 @@ async def test_fetch_member_cached_hits_rest_only_once():
 
     assert first is member and second is member
     guild.fetch_member.assert_awaited_once()
+
+
+# ---------------------------------------------------------------
+# Buffered CommandUsage inserts
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_command_usage_is_buffered_until_flush(clean_db):
+    import models
+
+    with patch.object(bot_module, "COMMAND_USAGE_FLUSH_SIZE", 3):
+        assert bot_module.track_command_usage("1", "2", "verify") is None
+        assert bot_module.track_command_usage("1", "3", "verify") is None
+        assert clean_db.query(models.CommandUsage).count() == 0
+
+        flush = bot_module.track_command_usage("1", "4", "verify")  # hits the flush size
+        assert flush is not None
+        await flush
+        assert clean_db.query(models.CommandUsage).count() == 3
+        assert bot_module._command_usage_buffer == []
+        assert bot_module._command_usage_flush_handle is None
+
+
+# ---------------------------------------------------------------
+# In-memory cooldown short-circuit
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_verify_in_cooldown_skips_database():
+    mock_interaction = MagicMock()
+    mock_interaction.guild.id = 123
+    mock_interaction.user.id = 789
+    mock_interaction.locale = "en-US"
+    mock_interaction.response.defer = AsyncMock()
+    mock_interaction.followup.send = AsyncMock()
+
+    bot_module._record_cooldown("789")
+    try:
+        with patch("src.bot.session_scope") as mock_session_scope:
+            await bot_module.verify(mock_interaction)
+            mock_session_scope.assert_not_called()
+    finally:
+        bot_module._cooldown_cache.pop("789", None)
+
+    mock_interaction.followup.send.assert_awaited_once()
+
+
+# ---------------------------------------------------------------
+# aio-pika verification-result consumer
+# ---------------------------------------------------------------
+
+@pytest.fixture
+async def running_consumer():
+    """Start consume_queue against a mocked broker; yield (queue, channel)."""
+    import asyncio
+
+    queue = MagicMock()
+    queue.consume = AsyncMock()
+    channel = MagicMock()
+    channel.set_qos = AsyncMock()
+    channel.declare_queue = AsyncMock(return_value=queue)
+    connection = MagicMock()
+    connection.channel = AsyncMock(return_value=channel)
+    connection.close = AsyncMock()
+
+    with patch("src.bot._rabbitmq_connect_with_retry", new=AsyncMock(return_value=connection)):
+        task = asyncio.create_task(bot_module.consume_queue())
+        for _ in range(5):
+            await asyncio.sleep(0)
+        yield queue, channel
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    connection.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_consumer_retries_failed_setup():
+    import asyncio
+
+    queue = MagicMock()
+    queue.consume = AsyncMock()
+    channel = MagicMock()
+    channel.set_qos = AsyncMock()
+    channel.declare_queue = AsyncMock(side_effect=[RuntimeError("PRECONDITION_FAILED"), queue])
+    connection = MagicMock()
+    connection.channel = AsyncMock(return_value=channel)
+    connection.close = AsyncMock()
+
+    real_sleep = asyncio.sleep
+
+    async def yield_once(_):
+        await real_sleep(0)
+
+    # asyncio is shared, so this also sees the test's own sleep(0) yields
+    with patch("src.bot._rabbitmq_connect_with_retry", new=AsyncMock(return_value=connection)) as connect, \
+         patch("src.bot.asyncio.sleep", new=AsyncMock(side_effect=yield_once)) as sleep:
+        task = asyncio.create_task(bot_module.consume_queue())
+        for _ in range(10):
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    assert connect.await_count == 2
+    assert [c.args[0] for c in sleep.await_args_list if c.args[0]] == [2.0]
+    queue.consume.assert_awaited_once()
+
+
+def _incoming(body: bytes = b"{}", tag: int = 1, channel="ch"):
+    message = MagicMock()
+    message.body = body
+    message.delivery_tag = tag
+    message.channel = channel
+    message.ack = AsyncMock()
+    message.reject = AsyncMock()
+    return message
+
+
+@pytest.mark.asyncio
+async def test_consumer_sets_bounded_prefetch(running_consumer):
+    _, channel = running_consumer
+    channel.set_qos.assert_awaited_once_with(prefetch_count=bot_module.RABBITMQ_PREFETCH)
+
+
+@pytest.mark.asyncio
+async def test_consumer_processes_valid_message(running_consumer):
+    queue, _ = running_consumer
+    on_message = queue.consume.await_args.args[0]
+
+    with patch("src.bot.process_verification_result", new_callable=AsyncMock) as mock_process:
+        await on_message(_incoming(b'{"type": "verification_canceled", "guild_id": "1", "user_id": "2"}'))
+        mock_process.assert_awaited_once_with({"type": "verification_canceled", "guild_id": "1", "user_id": "2"})
+
+
+@pytest.mark.asyncio
+async def test_consumer_rejects_invalid_json(running_consumer):
+    queue, _ = running_consumer
+    on_message = queue.consume.await_args.args[0]
+
+    message = _incoming(b"not json")
+    with patch("src.bot.process_verification_result", new_callable=AsyncMock) as mock_process:
+        await on_message(message)
+        mock_process.assert_not_awaited()
+    message.reject.assert_awaited_once_with(requeue=False)
+
+
+@pytest.mark.asyncio
+async def test_ack_batcher_acks_only_the_completed_prefix():
+    """Tag 2 finishing before tag 1 must not be acked (multiple=True would
+    also ack the still-running tag 1)."""
+    batcher = bot_module._AckBatcher(batch_size=2, flush_seconds=60)
+    m1, m2, m3 = _incoming(tag=1), _incoming(tag=2), _incoming(tag=3)
+    for m in (m1, m2, m3):
+        batcher.track(m)
+
+    await batcher.done(m2)
+    await batcher.flush()
+    m2.ack.assert_not_awaited()
+
+    await batcher.done(m1)  # prefix 1..2 complete -> batch of 2 flushes
+    m2.ack.assert_awaited_once_with(multiple=True)
+    m1.ack.assert_not_awaited()
+
+    await batcher.done(m3)
+    await batcher.flush()
+    m3.ack.assert_awaited_once_with(multiple=True)
+
+
+@pytest.mark.asyncio
+async def test_ack_batcher_never_acks_on_a_rejected_delivery():
+    batcher = bot_module._AckBatcher(batch_size=10, flush_seconds=60)
+    m1, m2 = _incoming(tag=1), _incoming(tag=2)
+    batcher.track(m1)
+    batcher.track(m2)
+
+    await batcher.done(m1)
+    await batcher.done(m2, settled=True)
+    await batcher.flush()
+
+    m1.ack.assert_awaited_once_with(multiple=True)
+    m2.ack.assert_not_awaited()
+
+
+# ---------------------------------------------------------------
+# Stripe Identity session creation
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_generate_verification_url_uses_async_stripe_client():
+    session = MagicMock()
+    session.url = "https://verify.stripe.com/start/test"
+    with patch("src.bot.stripe.identity.VerificationSession.create_async",
+               new=AsyncMock(return_value=session)) as mock_create:
+        url = await bot_module.generate_stripe_verification_url("1", 2, "3", "4")
+
+    assert url == session.url
+    kwargs = mock_create.await_args.kwargs
+    assert kwargs["metadata"] == {"guild_id": "1", "user_id": "2", "role_id": "3", "channel_id": "4"}
+
+
+# ---------------------------------------------------------------
+# Server config TTL cache
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_server_config_cache_hits_until_invalidated(clean_db):
+    import models
+
+    clean_db.add(models.Server(server_id="321", owner_id="1", minimum_age=18))
+    clean_db.commit()
+    with patch("src.bot.get_server_config", wraps=bot_module.get_server_config) as loader:
+        first = await bot_module.get_server_config_cached(321)
+        again = await bot_module.get_server_config_cached("321")
+        assert loader.call_count == 1
+        assert again is first and first.minimum_age == 18
+
+        clean_db.query(models.Server).filter_by(server_id="321").update({"minimum_age": 21})
+        clean_db.commit()
+        bot_module.invalidate_server_config(321)
+        fresh = await bot_module.get_server_config_cached(321)
+        assert loader.call_count == 2
+        assert fresh.minimum_age == 21
+
+
+# ---------------------------------------------------------------
+# Batched verification-result writes
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_verification_writes_coalesce_into_one_flush(clean_db):
+    import asyncio
+    from datetime import datetime, timezone
+    import models
+
+    clean_db.add(models.Server(server_id="10", owner_id="1", verifications_count=5))
+    clean_db.add(models.Server(server_id="20", owner_id="1", verifications_count=1))
+    for uid in ("1", "2", "3"):
+        clean_db.add(models.User(discord_id=uid, verification_status=False,
+                                 last_verification_attempt=datetime.now(timezone.utc)))
+    clean_db.commit()
+    buffer = bot_module._PendingVerificationWrites(batch_size=50, flush_seconds=60)
+    with patch("src.bot._apply_verification_writes",
+               wraps=bot_module._apply_verification_writes) as apply:
+        waiters = [buffer.add(10, 1), buffer.add(10, 2), buffer.add(20, 3), buffer.add(20, 3)]
+        assert not any(w.done() for w in waiters)
+        await buffer.flush()
+        await asyncio.gather(*waiters)
+    apply.assert_called_once()
+
+    clean_db.expire_all()
+    counts = {s.server_id: s.verifications_count for s in clean_db.query(models.Server)}
+    assert counts == {"10": 3, "20": 0}  # never below zero
+    assert all(u.verification_status for u in clean_db.query(models.User))
+
+
+# ---------------------------------------------------------------
+# Command tree sync guard
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_command_tree_sync_skipped_when_unchanged(tmp_path):
+    hash_file = tmp_path / "tree.sha256"
+    tree = bot_module.bot.tree
+    with patch.object(bot_module, "COMMAND_SYNC_HASH_PATH", str(hash_file)), \
+         patch.object(tree, "sync", new=AsyncMock(return_value=[])) as sync:
+        await bot_module.bot._sync_command_tree()  # no recorded hash yet
+        assert sync.await_count == 1
+        assert hash_file.read_text() == bot_module._command_tree_hash(tree)
+
+        await bot_module.bot._sync_command_tree()  # same commands
+        assert sync.await_count == 1
+
+        hash_file.write_text("stale")
+        await bot_module.bot._sync_command_tree()
+        assert sync.await_count == 2
+
+
+# ---------------------------------------------------------------
+# Per-guild role-assignment concurrency cap
+# ---------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_role_assignment_capped_per_guild():
+    import asyncio
+
+    active = {1: 0, 2: 0}
+    peak = {1: 0, 2: 0}
+
+    async def fake_assign(guild_id, user_id, role_id, **kwargs):
+        active[guild_id] += 1
+        peak[guild_id] = max(peak[guild_id], active[guild_id])
+        await asyncio.sleep(0.01)
+        active[guild_id] -= 1
+
+    done = asyncio.get_running_loop().create_future()
+    done.set_result(None)
+    messages = [{"type": "verification_verified", "guild_id": str(g), "user_id": str(u), "role_id": "9"}
+                for g in (1, 2) for u in range(8)]
+    with patch.object(bot_module, "ROLE_ASSIGN_CONCURRENCY_PER_GUILD", 3), \
+         patch("src.bot.assign_role", new=fake_assign), \
+         patch.object(bot_module._verification_writes, "add", return_value=done):
+        await asyncio.gather(*(bot_module.process_verification_result(m) for m in messages))
+
+    assert peak == {1: 3, 2: 3}
+    assert bot_module._role_assign_slots == {}
+
+
+# ---------------------------------------------------------------
+# Age calculation
+# ---------------------------------------------------------------
+
+@pytest.mark.parametrize("dob, today, expected", [
+    ((2000, 6, 15), (2018, 6, 14), 17),
+    ((2000, 6, 15), (2018, 6, 15), 18),
+    ((2000, 2, 29), (2018, 2, 28), 17),
+    ((2000, 2, 29), (2018, 3, 1), 18),
+    ((2000, 2, 29), (2020, 2, 29), 20),
+])
+def test_age_in_years(dob, today, expected):
+    from datetime import datetime, timezone
+    assert bot_module.age_in_years(datetime(*dob), datetime(*today, tzinfo=timezone.utc)) == expected
+
+
+def test_save_server_fields_upserts_without_clobbering_other_columns(clean_db):
+    import models
+
+    interaction = MagicMock()
+    interaction.guild.id = 4242
+    interaction.guild.owner_id = 1
+    bot_module._save_server_fields(interaction, minimum_age=21)
+    bot_module._save_server_fields(interaction, instructions_locale="de")
+
+    rows = clean_db.query(models.Server).filter_by(server_id="4242").all()
+    assert len(rows) == 1
+    assert rows[0].minimum_age == 21
+    assert rows[0].instructions_locale == "de"
+    assert rows[0].owner_id == "1"
+
+
+@pytest.mark.asyncio
+async def test_refresh_instruction_panels_clears_stale_refs_in_one_update(clean_db):
+    import discord
+    import models
+
+    clean_db.add_all([
+        models.Server(server_id=str(n), owner_id="1", instructions_channel_id="10",
+                      instructions_message_id=str(n))
+        for n in (801, 802)
+    ])
+    clean_db.commit()
+    channel = MagicMock()
+    channel.fetch_message = AsyncMock(side_effect=discord.NotFound(MagicMock(status=404), "gone"))
+    with patch.object(bot_module.bot, "get_channel", return_value=channel):
+        await bot_module.refresh_instruction_panels()
+    clean_db.expire_all()
+    assert [s.instructions_message_id for s in clean_db.query(models.Server)] == [None, None]
+
+
+@pytest.mark.asyncio
+async def test_track_verification_attempt_upserts_and_keeps_status(clean_db):
+    from datetime import datetime, timezone
+    import models
+
+    first = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    later = datetime(2026, 2, 1, tzinfo=timezone.utc)
+    clean_db.add(models.User(discord_id="7070", verification_status=True, last_verification_attempt=first))
+    clean_db.commit()
+    await bot_module.track_verification_attempt(7070, later)
+    await bot_module.track_verification_attempt(7071, later)
+
+    clean_db.expire_all()
+    users = {u.discord_id: u for u in clean_db.query(models.User)}
+    assert users["7070"].verification_status is True
+    assert users["7070"].last_verification_attempt.replace(tzinfo=timezone.utc) == later
+    assert users["7071"].verification_status is False
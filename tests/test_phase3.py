@@ -7,7 +7,6 @@ from datetime import datetime, timezone
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 
-import models
 import src.bot as bot_module
 from src.bot import sanitize_custom_message, get_message
 from models import Server, User
@@ -95,19 +94,6 @@ def test_all_locales_complete_and_placeholders_match():
 # on_member_join auto-verify
 # ---------------------------------------------------------------
 
-@pytest.fixture(scope="function")
-def clean_db():
-    session = models.Session()
-    session.query(Server).delete()
-    session.query(User).delete()
-    session.commit()
-    yield session
-    session.query(Server).delete()
-    session.query(User).delete()
-    session.commit()
-    session.close()
-
-
 def _make_member(guild_id="100", user_id="200"):
     member = MagicMock()
     member.guild.id = guild_id
@@ -140,7 +126,7 @@ async def test_on_member_join_assigns_role_to_verified_user(clean_db):
         await bot_module.on_member_join(_make_member())
         mock_assign.assert_awaited_once()
         args, kwargs = mock_assign.await_args
-        assert args[0] == "100" and args[1] == "200" and args[2] == "999"
+        assert args[0] == "100" and args[1] == "200" and args[2] == 999
         assert kwargs.get("notify_success_dm") is True
 
 
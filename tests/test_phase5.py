@@ -9,24 +9,12 @@ from types import SimpleNamespace
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 
-import models
 import billing
 import src.bot as bot_module
 import subscription_checker
 from models import Server
 
 
-@pytest.fixture(scope="function")
-def clean_db():
-    session = models.Session()
-    session.query(Server).delete()
-    session.commit()
-    yield session
-    session.query(Server).delete()
-    session.commit()
-    session.close()
-
-
 # ---------------------------------------------------------------
 # billing.apply_tier — shared refill semantics
 # ---------------------------------------------------------------
@@ -10,6 +10,8 @@ import src.stripe_webhook_service as stripe_service
 def mock_rabbitmq():
     with patch("src.stripe_webhook_service.pika.BlockingConnection") as mock_connection:
         yield mock_connection
+    # Don't carry a mocked publisher connection into the next test
+    stripe_service._publisher_pool.close()
 
 @pytest.fixture(scope="function")
 def allow_unsigned():
@@ -28,3 +30,207 @@ def test_unsigned_webhook_rejected_by_default(mock_rabbitmq):
     client = stripe_service.app.test_client()
     response = client.post("/stripe_webhook", json={"type": "identity.verification_session.verified"})
     assert response.status_code == 400
+
+def test_send_to_queue_uses_publisher_confirms_and_retries_nack(mock_rabbitmq):
+    from pika.exceptions import NackError
+    channel = mock_rabbitmq.return_value.channel.return_value
+    channel.basic_publish.side_effect = [NackError([]), None]
+
+    with patch("src.stripe_webhook_service.time.sleep"):
+        stripe_service.send_to_queue({"type": "verification_verified"}, max_retries=3)
+
+    channel.confirm_delivery.assert_called()
+    assert channel.basic_publish.call_count == 2
+    assert channel.basic_publish.call_args.kwargs["mandatory"] is True
+
+def test_send_to_queue_makes_at_least_one_attempt(mock_rabbitmq):
+    from pika.exceptions import NackError
+    channel = mock_rabbitmq.return_value.channel.return_value
+    channel.basic_publish.side_effect = NackError([])
+
+    with pytest.raises(NackError):
+        stripe_service.send_to_queue({"type": "verification_verified"}, max_retries=0)
+    assert channel.basic_publish.call_count == 1
+
+def test_send_to_queue_publishes_json_bytes(mock_rabbitmq):
+    import orjson
+    channel = mock_rabbitmq.return_value.channel.return_value
+    message = {"type": "verification_verified", "guild_id": "1", "user_id": "2", "role_id": "3"}
+
+    stripe_service.send_to_queue(message)
+
+    body = channel.basic_publish.call_args.kwargs["body"]
+    assert isinstance(body, bytes)
+    assert orjson.loads(body) == message
+
+def test_send_to_queue_reuses_connection_and_reconnects_when_lost(mock_rabbitmq):
+    from pika.exceptions import StreamLostError
+    with patch("src.stripe_webhook_service.time.sleep"):
+        stripe_service.send_to_queue({"n": 1})
+        stripe_service.send_to_queue({"n": 2})
+        assert mock_rabbitmq.call_count == 1
+        channel = mock_rabbitmq.return_value.channel.return_value
+        channel.queue_declare.assert_called_once()
+        assert channel.basic_publish.call_count == 2
+
+        # Broker dropped the idle connection: detected before publishing
+        mock_rabbitmq.return_value.process_data_events.side_effect = [StreamLostError(), None]
+        stripe_service.send_to_queue({"n": 3})
+        assert mock_rabbitmq.call_count == 2
+        assert channel.basic_publish.call_count == 3
+
+def test_send_to_queue_reopens_only_the_channel_with_backoff(mock_rabbitmq):
+    from pika.exceptions import ChannelClosed
+    connection = mock_rabbitmq.return_value
+    channel = connection.channel.return_value
+    channel.basic_publish.side_effect = [ChannelClosed(404, "NOT_FOUND"), ChannelClosed(404, "NOT_FOUND"), None]
+
+    with patch("src.stripe_webhook_service.time.sleep") as sleep:
+        stripe_service.send_to_queue({"n": 1}, max_retries=3)
+
+    assert mock_rabbitmq.call_count == 1  # same connection throughout
+    assert connection.channel.call_count == 3
+    assert [c.args[0] for c in sleep.call_args_list] == [0.1, 0.2]
+
+def test_publisher_pool_hands_out_separate_channels(mock_rabbitmq):
+    pool = stripe_service._PublisherPool(size=2)
+    mock_rabbitmq.side_effect = lambda *a, **k: MagicMock()
+    with pool.channel() as first, pool.channel() as second:
+        assert first is not second
+    assert mock_rabbitmq.call_count == 2
+    with pool.channel():
+        pass
+    assert mock_rabbitmq.call_count == 2  # reused, not reopened
+    pool.close()
+
+
+def _signed(payload: bytes, secret: str, timestamp=None):
+    import hashlib
+    import hmac
+    import time
+    ts = str(int(timestamp if timestamp is not None else time.time()))
+    sig = hmac.new(secret.encode(), ts.encode() + b"." + payload, hashlib.sha256).hexdigest()
+    return f"t={ts},v0=ignored,v1={sig}"
+
+
+def test_signed_webhook_verified_inline(mock_rabbitmq):
+    import json
+    import stripe_signature
+    payload = json.dumps({"type": "some.other_event", "data": {"object": {}}}).encode()
+    secret = stripe_service.STRIPE_WEBHOOK_SECRET
+
+    assert stripe_signature.verify_webhook_event(payload, _signed(payload, secret), secret)["type"] == "some.other_event"
+
+    client = stripe_service.app.test_client()
+    ok = client.post("/stripe_webhook", data=payload, headers={"Stripe-Signature": _signed(payload, secret)})
+    assert ok.status_code == 200
+    tampered = client.post("/stripe_webhook", data=payload + b" ", headers={"Stripe-Signature": _signed(payload, secret)})
+    assert tampered.status_code == 400
+    stale = client.post("/stripe_webhook", data=payload,
+                        headers={"Stripe-Signature": _signed(payload, secret, timestamp=1_000_000_000)})
+    assert stale.status_code == 400
+
+
+def test_non_ascii_signature_is_rejected_not_an_error():
+    import time
+    import stripe
+    import stripe_signature
+    payload = b'{"type": "some.other_event"}'
+    for header in (f"t={int(time.time())},v1=\u00e9" + "0" * 63, "t=\u00b2\u00b3,v1=" + "0" * 64):
+        with pytest.raises(stripe.error.SignatureVerificationError):
+            stripe_signature.verify_webhook_event(payload, header, "whsec_test")
+
+
+def test_verified_webhook_is_handled_before_the_ack(mock_rabbitmq, allow_unsigned):
+    client = stripe_service.app.test_client()
+    event = {"type": "identity.verification_session.verified", "data": {"object": {"id": "vs_inline"}}}
+    with patch.object(stripe_service, "handle_verification_verified") as handler:
+        response = client.post("/stripe_webhook", json=event)
+    assert response.status_code == 200
+    handler.assert_called_once_with({"id": "vs_inline"})
+
+
+def test_duplicate_event_delivery_is_acked_once(mock_rabbitmq):
+    import json
+    payload = json.dumps({"id": "evt_dup_1", "type": "identity.verification_session.verified",
+                          "data": {"object": {"id": "vs_dup"}}}).encode()
+    secret = stripe_service.STRIPE_WEBHOOK_SECRET
+    client = stripe_service.app.test_client()
+    with patch.object(stripe_service, "handle_verification_verified") as handler:
+        for _ in range(2):
+            response = client.post("/stripe_webhook", data=payload,
+                                   headers={"Stripe-Signature": _signed(payload, secret)})
+            assert response.status_code == 200
+    handler.assert_called_once()
+
+
+def test_failed_event_returns_500_and_allows_redelivery(mock_rabbitmq, clean_db):
+    import json
+    from pika.exceptions import AMQPConnectionError
+    payload = json.dumps({"id": "evt_fail_1", "type": "identity.verification_session.canceled",
+                          "data": {"object": {"metadata": {"user_id": "556"}}}}).encode()
+    secret = stripe_service.STRIPE_WEBHOOK_SECRET
+    client = stripe_service.app.test_client()
+    mock_rabbitmq.side_effect = AMQPConnectionError()
+    with patch("src.stripe_webhook_service.time.sleep"):
+        failed = client.post("/stripe_webhook", data=payload,
+                             headers={"Stripe-Signature": _signed(payload, secret)})
+    assert failed.status_code == 500
+
+    mock_rabbitmq.side_effect = None
+    retry = client.post("/stripe_webhook", data=payload, headers={"Stripe-Signature": _signed(payload, secret)})
+    assert retry.status_code == 200
+    mock_rabbitmq.return_value.channel.return_value.basic_publish.assert_called_once()
+
+
+def test_recent_events_expire_and_stay_bounded():
+    recent = stripe_service._RecentEvents(maxsize=2, ttl=60)
+    with patch("src.stripe_webhook_service.time.monotonic", return_value=0.0):
+        assert recent.claim("a") and recent.claim("b")
+        assert not recent.claim("a")
+        assert recent.claim("c")  # evicts "a", the oldest, at maxsize
+        assert recent.claim("a")
+    with patch("src.stripe_webhook_service.time.monotonic", return_value=61.0):
+        assert recent.claim("c")
+
+
+def _verification_session(dob):
+    return {"metadata": {"guild_id": "1", "user_id": "555", "role_id": "3"},
+            "verified_outputs": {"dob": dob}}
+
+
+def test_verified_session_stores_encrypted_dob_string(clean_db):
+    import models
+    with patch("src.stripe_webhook_service.stripe.identity.VerificationSession.retrieve",
+               return_value=_verification_session({"year": 2001, "month": 2, "day": 3})), \
+         patch("src.stripe_webhook_service.send_to_queue") as send:
+        stripe_service.handle_verification_verified({"id": "vs_1"})
+
+    user = clean_db.query(models.User).filter_by(discord_id="555").one()
+    assert stripe_service.decrypt_dob(user.dob) == stripe_service.datetime(2001, 2, 3)
+    send.assert_called_once()
+
+
+def test_verification_results_upsert_one_row_per_user(clean_db):
+    import models
+    with patch("src.stripe_webhook_service.stripe.identity.VerificationSession.retrieve",
+               return_value=_verification_session({"year": 2001, "month": 2, "day": 3})), \
+         patch("src.stripe_webhook_service.send_to_queue"):
+        stripe_service.handle_verification_canceled({"metadata": {"user_id": "555"}})
+        stripe_service.handle_verification_verified({"id": "vs_1"})
+        stripe_service.handle_verification_verified({"id": "vs_1"})
+
+    users = clean_db.query(models.User).filter_by(discord_id="555").all()
+    assert len(users) == 1
+    assert users[0].verification_status is True
+    assert users[0].dob is not None
+
+
+def test_verified_session_without_dob_is_not_marked_verified():
+    with patch("src.stripe_webhook_service.stripe.identity.VerificationSession.retrieve",
+               return_value=_verification_session({"year": 2001})), \
+         patch("src.stripe_webhook_service.session_scope") as scope, \
+         patch("src.stripe_webhook_service.send_to_queue") as send:
+        stripe_service.handle_verification_verified({"id": "vs_2"})
+    scope.assert_not_called()
+    send.assert_not_called()
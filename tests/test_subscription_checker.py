@@ -3,14 +3,71 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
 import pytest
-from unittest.mock import patch, MagicMock
 import subscription_checker
 
 
-def test_check_subscriptions_queries_verification_db():
-    with patch.object(subscription_checker, "session_scope") as mock_scope:
-        mock_session = MagicMock()
-        mock_scope.return_value.__enter__.return_value = mock_session
-        subscription_checker.check_subscriptions()
-        mock_scope.assert_called()
-        mock_session.query.assert_called()
+def test_check_subscriptions_lapses_both_rails(clean_db):
+    """One UPDATE lapses stale stripe and discord servers and leaves the
+    rest active."""
+    from datetime import datetime, timezone, timedelta
+    import models
+
+    now = datetime.now(timezone.utc)
+    clean_db.add_all([
+        models.Server(server_id="900", owner_id="1", subscription_status=True,
+                      payment_provider="stripe",
+                      last_renewal_date=now - timedelta(days=40)),
+        models.Server(server_id="901", owner_id="1", subscription_status=True,
+                      payment_provider="stripe",
+                      last_renewal_date=now - timedelta(days=5)),
+        models.Server(server_id="902", owner_id="1", subscription_status=True,
+                      payment_provider="discord",
+                      entitlement_ends_at=now - timedelta(days=10)),
+        models.Server(server_id="903", owner_id="1", subscription_status=True,
+                      payment_provider="discord",
+                      entitlement_ends_at=now + timedelta(days=1)),
+        models.Server(server_id="904", owner_id="1", subscription_status=True,
+                      payment_provider="discord",
+                      entitlement_ends_at=None),
+    ])
+    clean_db.commit()
+    subscription_checker.check_subscriptions()
+    clean_db.expire_all()
+    status = {s.server_id: s.subscription_status for s in clean_db.query(models.Server)}
+    assert status == {"900": False, "901": True, "902": False, "903": True, "904": True}
+
+
+def test_renewed_stripe_server_is_not_lapsed_by_start_date(clean_db):
+    """Lapsing keys on last_renewal_date: a long-running subscription that
+    renewed recently must stay active."""
+    from datetime import datetime, timezone, timedelta
+    import models
+
+    now = datetime.now(timezone.utc)
+    clean_db.add_all([
+        models.Server(server_id="950", owner_id="1", subscription_status=True,
+                      subscription_start_date=now - timedelta(days=400),
+                      last_renewal_date=now - timedelta(days=5)),
+        models.Server(server_id="951", owner_id="1", subscription_status=True,
+                      subscription_start_date=now - timedelta(days=400),
+                      last_renewal_date=now - timedelta(days=40)),
+    ])
+    clean_db.commit()
+    subscription_checker.check_subscriptions()
+    clean_db.expire_all()
+    status = {s.server_id: s.subscription_status for s in clean_db.query(models.Server)}
+    assert status == {"950": True, "951": False}
+
+
+def test_prune_processed_events_drops_only_old_ids(clean_db):
+    from datetime import datetime, timezone, timedelta
+    import models
+
+    now = datetime.now(timezone.utc)
+    clean_db.add_all([
+        models.ProcessedEvent(event_id="evt_old", received_at=now - timedelta(days=45)),
+        models.ProcessedEvent(event_id="evt_new", received_at=now - timedelta(days=1)),
+    ])
+    clean_db.commit()
+    subscription_checker.prune_processed_events()
+    assert [e.event_id for e in clean_db.query(models.ProcessedEvent)] == ["evt_new"]
@@ -14,7 +14,7 @@ from src.subscription_manager import (
 
 @pytest.fixture(scope="function")
 def mock_external_systems():
-    with patch("src.subscription_manager.stripe.Webhook.construct_event") as mock_webhook, \
+    with patch("src.subscription_manager.verify_webhook_event") as mock_webhook, \
          patch("src.subscription_manager.stripe.Subscription.retrieve") as mock_retrieve:
         mock_webhook.return_value = {"type": "checkout.session.completed"}
         mock_retrieve.return_value = {"items": {"data": [{"price": {"product": "prod_test"}}]}}
@@ -24,6 +24,26 @@ def test_stripe_webhook(mock_external_systems):
     client = subscription_manager.app.test_client()
     response = client.post("/stripe-webhook", json={"id": "test_id"}, headers={"Stripe-Signature": "test_signature"})
     assert response.status_code == 200
+    assert response.get_json() == {"status": "success"}
+
+
+def test_stripe_webhook_ignores_unhandled_event_types(mock_external_systems):
+    mock_external_systems["mock_webhook"].return_value = {"type": "charge.updated"}
+    client = subscription_manager.app.test_client()
+    with patch.object(subscription_manager, "_event_executor") as executor:
+        response = client.post("/stripe-webhook", json={"id": "test_id"}, headers={"Stripe-Signature": "test_signature"})
+    assert response.get_json() == {"status": "ignored"}
+    executor.submit.assert_not_called()
+
+
+def test_stripe_webhook_returns_503_when_backlog_full(mock_external_systems):
+    client = subscription_manager.app.test_client()
+    with patch.object(subscription_manager, "_pending_events") as pending, \
+         patch.object(subscription_manager, "_event_executor") as executor:
+        pending.acquire.return_value = False
+        response = client.post("/stripe-webhook", json={"id": "test_id"}, headers={"Stripe-Signature": "test_signature"})
+    assert response.status_code == 503
+    executor.submit.assert_not_called()
 
 
 # ---------------------------------------------------------------
@@ -77,6 +97,35 @@ def test_checkout_routing_verification_product():
         mock_handler.assert_called_once()
 
 
+def test_checkout_routing_uses_expanded_line_items():
+    event = {
+        "type": "checkout.session.completed",
+        "data": {"object": {"subscription": "sub_route_3",
+                            "line_items": {"data": [{"price": {"product": any_tier_product_id()}}]}}},
+    }
+
+    with patch("src.subscription_manager.stripe.Subscription.retrieve") as mock_retrieve, \
+         patch("src.subscription_manager.handle_verification_checkout_session") as mock_handler:
+        process_event(event)
+        mock_retrieve.assert_not_called()
+        mock_handler.assert_called_once_with(event["data"]["object"], any_tier_product_id())
+
+
+def test_redelivered_event_is_processed_once():
+    event = {
+        "id": "evt_once_1",
+        "type": "checkout.session.completed",
+        "data": {"object": {"subscription": "sub_route_4"}},
+    }
+
+    with patch("src.subscription_manager.stripe.Subscription.retrieve") as mock_retrieve, \
+         patch("src.subscription_manager.handle_verification_checkout_session") as mock_handler:
+        mock_retrieve.return_value = {"items": {"data": [{"price": {"product": any_tier_product_id()}}]}}
+        process_event(event)
+        process_event(event)
+        mock_handler.assert_called_once()
+
+
 def _tier_product_and_tokens():
     product_id = next(pid for pid, info in PRODUCT_ID_TO_TIER.items() if info["tokens"] > 0)
     return product_id, PRODUCT_ID_TO_TIER[product_id]["tokens"]
@@ -129,6 +178,78 @@ def test_non_renewal_update_does_not_reset_tokens(verification_db):
     assert server.verifications_count == 7
 
 
+def test_checkout_upserts_server_and_tops_up_tokens(verification_db):
+    product_id, tier_tokens = _tier_product_and_tokens()
+    checkout = {
+        "id": "cs_1",
+        "subscription": "sub_checkout_1",
+        "customer_details": {"email": "owner@example.com"},
+        "custom_fields": [
+            {"key": "discordserverid", "text": {"value": "920"}},
+            {"key": "discorduseridnotyourusername", "text": {"value": "921"}},
+        ],
+        "metadata": {"role_id": "922"},
+    }
+    with patch("src.subscription_manager.stripe.checkout.Session.list_line_items") as mock_items:
+        mock_items.return_value = {"data": [{"price": {"product": product_id}}]}
+        subscription_manager.handle_verification_checkout_session(checkout)
+        subscription_manager.handle_verification_checkout_session(checkout)
+
+    verification_db.expire_all()
+    servers = verification_db.query(Server).filter_by(server_id="920").all()
+    assert len(servers) == 1
+    assert servers[0].owner_id == "921"
+    assert servers[0].subscription_status is True
+    assert servers[0].verifications_count == 2 * tier_tokens
+
+
+def test_subscription_created_keeps_existing_start_date_and_tokens(verification_db):
+    from datetime import datetime, timezone
+
+    product_id, _ = _tier_product_and_tokens()
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    period_start = datetime(2026, 8, 1, tzinfo=timezone.utc)
+    verification_db.add(Server(server_id="930", owner_id="931", subscription_status=False,
+                               verifications_count=4, subscription_start_date=started))
+    verification_db.commit()
+
+    with patch("src.subscription_manager.stripe.Subscription.retrieve") as mock_retrieve:
+        mock_retrieve.return_value = {"items": {"data": [{"price": {"product": product_id}}]}}
+        subscription_manager.handle_verification_subscription_created(
+            "sub_created_1", "active", {"guild_id": "930"}, period_start,
+        )
+
+    verification_db.expire_all()
+    server = verification_db.query(Server).filter_by(server_id="930").one()
+    assert server.subscription_status is True
+    assert server.stripe_subscription_id == "sub_created_1"
+    assert server.verifications_count == 4
+    assert server.subscription_start_date.replace(tzinfo=timezone.utc) == started
+    assert server.last_renewal_date.replace(tzinfo=timezone.utc) == period_start
+
+
+def test_subscription_updated_event_uses_payload_product(verification_db):
+    product_id, _ = _tier_product_and_tokens()
+    verification_db.add(Server(server_id="940", owner_id="941", subscription_status=False))
+    verification_db.commit()
+    event = {
+        "type": "customer.subscription.updated",
+        "data": {"object": {
+            "id": "sub_payload_1", "status": "active", "metadata": {"guild_id": "940"},
+            "items": {"data": [{"price": {"product": product_id}}]},
+        }},
+    }
+
+    with patch("src.subscription_manager.stripe.Subscription.retrieve") as mock_retrieve:
+        process_event(event)
+        mock_retrieve.assert_not_called()
+
+    verification_db.expire_all()
+    server = verification_db.query(Server).filter_by(server_id="940").one()
+    assert server.subscription_status is True
+    assert server.tier == PRODUCT_ID_TO_TIER[product_id]["tier"]
+
+
 def test_verification_subscription_deleted_marks_inactive(verification_db):
     verification_db.add(Server(server_id="777", owner_id="888",
                                 subscription_status=True, stripe_subscription_id="sub_verify_1"))
@@ -139,3 +260,61 @@ def test_verification_subscription_deleted_marks_inactive(verification_db):
     verification_db.expire_all()
     server = verification_db.query(Server).filter_by(server_id="777").first()
     assert server.subscription_status is False
+
+
+def test_late_older_update_does_not_override_newer_delete(verification_db):
+    product_id, _ = _tier_product_and_tokens()
+    verification_db.add(Server(server_id="950", owner_id="951", subscription_status=True,
+                                stripe_subscription_id="sub_order_1"))
+    verification_db.commit()
+    subscription = {
+        "id": "sub_order_1", "status": "active", "metadata": {"guild_id": "950"},
+        "items": {"data": [{"price": {"product": product_id}}]},
+    }
+
+    process_event({"id": "evt_order_del", "created": 1_700_000_100,
+                   "type": "customer.subscription.deleted", "data": {"object": subscription}})
+    process_event({"id": "evt_order_upd", "created": 1_700_000_000,
+                   "type": "customer.subscription.updated", "data": {"object": subscription}})
+
+    verification_db.expire_all()
+    server = verification_db.query(Server).filter_by(server_id="950").one()
+    assert server.subscription_status is False
+
+
+def test_failed_handler_releases_event_claim(verification_db):
+    """The claim commits with the handler's write, so a failed event can be
+    processed again when it is resent."""
+    product_id, _ = _tier_product_and_tokens()
+    verification_db.add(Server(server_id="960", owner_id="961", subscription_status=True,
+                                stripe_subscription_id="sub_retry_1"))
+    verification_db.commit()
+    event = {"id": "evt_retry_1", "type": "customer.subscription.deleted",
+             "data": {"object": {"id": "sub_retry_1", "metadata": {},
+                                 "items": {"data": [{"price": {"product": product_id}}]}}}}
+
+    def fail_inside_transaction(*args, **kwargs):
+        with models.session_scope():
+            raise RuntimeError("database went away")
+
+    with patch("src.subscription_manager.handle_verification_subscription_deleted",
+               side_effect=fail_inside_transaction):
+        process_event(event)
+    process_event(event)
+
+    verification_db.expire_all()
+    server = verification_db.query(Server).filter_by(server_id="960").one()
+    assert server.subscription_status is False
+
+
+def test_stripe_calls_use_the_shared_session_with_timeout():
+    """Every Stripe call goes through the one keep-alive session with the
+    fail-fast timeout, and the SDK retries dropped connections."""
+    import stripe
+    client = subscription_manager._stripe_client
+    assert isinstance(client, stripe.RequestsClient)
+    with patch.object(subscription_manager._stripe_http, "request") as request:
+        request.return_value = MagicMock(content=b"{}", status_code=200, headers={})
+        client.request("get", "https://api.stripe.com/v1/subscriptions/sub_1", {})
+    assert request.call_args.kwargs["timeout"] == 20.0
+    assert stripe.max_network_retries == 2